@@ -1,3 +1,4 @@
+import sys
 import pygame
 from Gameclass import Game, load_game_assets
 import Gameclass
@@ -5,6 +6,13 @@ import maptools
 from EntityWidgets import EntityWidget
 import EntityWidgets
 from SpellWidgets import BowSpell, LinearSpell, CircularSpell, TriangleSpell
+import render_tools
+from prompt_tools import PROMPTS
+from fight_tools import TOOLS
+import event_tools
+
+# Запуск с --full-redraw возвращает старый режим: перерисовка всего экрана каждый кадр
+FULL_REDRAW = "--full-redraw" in sys.argv
 
 class Button:
     def __init__(self, x, y, width, height, text, font, color, text_color, action=None, hotkey=None):
@@ -15,10 +23,16 @@ class Button:
         self.text_color = text_color
         self.action = action
         self.hotkey = hotkey  # Горячая клавиша (по умолчанию None)
+        self._label = None
+        self._label_key = None
 
     def draw(self, surface):
         pygame.draw.rect(surface, self.color, self.rect)
-        text_surface = self.font.render(self.text, True, self.text_color)
+        # Надпись перерисовывается только если поменялся текст или цвет
+        if self._label_key != (self.text, self.text_color):
+            self._label = self.font.render(self.text, True, self.text_color)
+            self._label_key = (self.text, self.text_color)
+        text_surface = self._label
         text_rect = text_surface.get_rect(center=self.rect.center)
         surface.blit(text_surface, text_rect)
 
@@ -40,6 +54,8 @@ screen_width, screen_height = info.current_w, info.current_h
 screen = pygame.display.set_mode((screen_width, screen_height), pygame.RESIZABLE)
 pygame.display.set_caption("RaDnDom fight visualiser")
 
+render_tools.get_icon_atlas()  # Иконки тулбаров грузятся один раз при старте
+
 game = Game()
 map_image, players, monsters, num_tiles, map_type = load_game_assets(game)
 print(map_type)
@@ -69,6 +85,7 @@ grid = maptools.create_grid(
     total_height=corrected_height
 )
 
+grid_overlay = maptools.GridOverlay(grid)
 map_manager = maptools.MapManager(grid)
 
 hero_widgets = []
@@ -79,6 +96,9 @@ hero_start_y = left_top[1] + 100
 monster_start_x = left_top[0] - widget_diameter - 40
 monster_start_y = left_top[1] + 100
 widget_spacing = widget_diameter + 20
+all_fighters = players + monsters
+initiative_manager = maptools.InitiativeManager(map_manager, all_fighters)
+
 x, y, cell_size = 0, 0, scaled_width // cols
 spell_widgets = [BowSpell(screen, x, y, cell_size, map_manager), LinearSpell(screen, x, y, cell_size, map_manager), 
                  CircularSpell(screen, x, y, cell_size, map_manager), TriangleSpell(screen, x, y, cell_size, map_manager)]
@@ -86,15 +106,14 @@ spell_widgets = [BowSpell(screen, x, y, cell_size, map_manager), LinearSpell(scr
 for i, hero in enumerate(players):
     widget_x = hero_start_x
     widget_y = hero_start_y + i * widget_spacing
-    hero_widgets.append(EntityWidget(hero, widget_diameter, widget_x, widget_y, widget_diameter, map_manager, screen, spell_widgets))
+    hero_widgets.append(EntityWidget(hero, widget_diameter, widget_x, widget_y, widget_diameter, map_manager, screen, spell_widgets,
+                                     initiative_manager))
 
 for i, monster in enumerate(monsters):
     widget_x = monster_start_x
     widget_y = monster_start_y + i * widget_spacing
-    monster_widgets.append(EntityWidget(monster, widget_diameter, widget_x, widget_y, widget_diameter, map_manager, screen, spell_widgets))
-all_fighters = players + monsters
-
-initiative_manager = maptools.InitiativeManager(map_manager, all_fighters)
+    monster_widgets.append(EntityWidget(monster, widget_diameter, widget_x, widget_y, widget_diameter, map_manager, screen, spell_widgets,
+                                        initiative_manager))
 
 all_widgets = hero_widgets + monster_widgets + spell_widgets
 entity_widgets = all_widgets
@@ -108,13 +127,19 @@ print([widget.entity.hotkey for widget in monster_widgets])
 
 
 def recalculate_damage():
-    for widget in entity_widgets:
-        if isinstance(widget, EntityWidget):
-            widget.get_damage()
+    # Урон под всеми сущностями собирается одним проходом по массивам карты
+    for entity, damage in map_manager.damage_by_entity().items():
+        entity.hp = entity.hp - damage
     pygame.display.flip()
     map_manager.reset_damage()
 
-font = pygame.font.Font(None, 36)
+def change_turn(step):
+    # Кнопки очерёдности: на пустом поле сообщаем мастеру прямо в окне
+    changed = initiative_manager.update_current_index() if step > 0 else initiative_manager.gowngrade_current_index()
+    if not changed:
+        PROMPTS.toast("На поле никого нет")
+
+font = render_tools.get_font(36)
 button_width, button_height = 200, 50
 button_x = screen_width - button_width - 20
 button_y = screen_height - button_height - 20
@@ -137,58 +162,125 @@ small_button_x = button_x
 small_button_y = button_y - button_height - 10
 
 prev_button = Button(small_button_x, small_button_y, small_button_width, button_height, 
-                     "<=", font, Gameclass.CURRENT_COLOR_PRESET.button_fill, Gameclass.CURRENT_COLOR_PRESET.button_font, lambda: initiative_manager.update_current_index())
+                     "<=", font, Gameclass.CURRENT_COLOR_PRESET.button_fill, Gameclass.CURRENT_COLOR_PRESET.button_font, lambda: change_turn(1))
 roll_button = Button(small_button_x + small_button_width + 10, small_button_y, small_button_width, button_height, 
                      "Roll I", font, Gameclass.CURRENT_COLOR_PRESET.button_fill, Gameclass.CURRENT_COLOR_PRESET.button_font, initiative_manager.set_initiatives)
 next_button = Button(small_button_x + 2 * (small_button_width + 10), small_button_y, small_button_width, button_height, 
-                     "=>", font, Gameclass.CURRENT_COLOR_PRESET.button_fill, Gameclass.CURRENT_COLOR_PRESET.button_font, lambda: initiative_manager.gowngrade_current_index())
+                     "=>", font, Gameclass.CURRENT_COLOR_PRESET.button_fill, Gameclass.CURRENT_COLOR_PRESET.button_font, lambda: change_turn(-1))
+
+buttons = [prev_button, roll_button, next_button, recalculate_button]
+
+# События мыши доходят только до виджетов под курсором или до того, кто захватил мышь
+router = event_tools.EventRouter()
+for button in [recalculate_button, prev_button, roll_button, next_button]:
+    router.register(button, lambda button=button: [button.rect])
+for widget in entity_widgets:
+    if isinstance(widget, EntityWidget):
+        router.register(widget, widget.get_hit_rects, lambda widget=widget: widget.is_dragging)
+    else:
+        # Видимое заклинание следует за мышью и ждёт клика в любом месте поля
+        router.register(widget, lambda: [], lambda widget=widget: widget.visible)
+round_label_pos = (small_button_x, small_button_y - button_height)
+
+
+def get_round_label():
+    return render_tools.render_text(f"Round {initiative_manager.round}", 36, Gameclass.CURRENT_COLOR_PRESET.button_font[:3])
+
+renderer = render_tools.DirtyRectRenderer(screen, full_redraw=FULL_REDRAW)
+scheduler = render_tools.FrameScheduler(active_fps=60, idle_timeout=500)
+
+
+def track_scene(mouse_pos):
+    """Сообщает рендеру, где и в каком состоянии находятся объекты сцены."""
+    hovered_cell = grid_overlay.cell_at(mouse_pos)
+    renderer.track("hover", hovered_cell.rect if hovered_cell else None)
+
+    for widget in all_widgets:
+        if isinstance(widget, EntityWidget):
+            renderer.track(widget, widget.get_bounds(), widget.get_render_state())
+        elif widget.visible:
+            bounds = widget.get_bounds(*mouse_pos)
+            if bounds is None:
+                # Размер превью ещё не известен — перерисовываем всё
+                renderer.invalidate_all()
+            renderer.track(widget, bounds, mouse_pos)
+
+    renderer.track("initiative", initiative_manager.get_current_entity_rect(), initiative_manager.current_index)
+    if initiative_manager.initiatives_set:
+        renderer.track("round", get_round_label().get_rect(topleft=round_label_pos), initiative_manager.round)
+    for button in buttons:
+        renderer.track(button, button.rect, button.text)
+    renderer.track("tool", TOOLS.get_bounds(), TOOLS.get_render_state())
+    renderer.track("prompts", PROMPTS.get_bounds(screen), PROMPTS.get_render_state())
+
+
+def board_is_busy():
+    """True, пока что-то двигается вслед за мышью и нужен ровный FPS."""
+    if PROMPTS.has_toasts():
+        return True  # Сообщения должны исчезнуть вовремя
+    for widget in all_widgets:
+        if isinstance(widget, EntityWidget):
+            if widget.is_dragging:
+                return True
+        elif widget.visible:
+            return True
+    return False
+
 
 running = True
 while running:
-    mouse_pos = pygame.mouse.get_pos()
+    events = scheduler.wait_events(board_is_busy())
+    if events:
+        router.refresh()  # Виджеты могли сдвинуться с прошлого кадра
+    for event in events:
+        if event.type != pygame.MOUSEMOTION:
+            # Клики и клавиши могут открыть окна Tk или нарисовать что-то в обход рендера
+            renderer.invalidate_all()
 
-    for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
-            
-        elif event.type == pygame.KEYDOWN:
+
+        # Открытый запрос ввода забирает себе все нажатия клавиш
+        if PROMPTS.handle_event(event):
+            continue
+        # Активное действие тулбара (шаг, удар) ждёт клика по полю; Esc его отменяет
+        if TOOLS.handle_event(event):
+            continue
+
+        if event.type == pygame.KEYDOWN:
             for widget in monster_widgets:
                 #print(event.unicode)
                 if event.unicode == widget.entity.hotkey:
                     widget.is_active = not widget.is_active
                     pygame.display.flip()
 
-        recalculate_button.handle_event(event)
-        prev_button.handle_event(event)
-        roll_button.handle_event(event)
-        next_button.handle_event(event)
+        router.dispatch(event)
 
-        for widget in entity_widgets:
-            widget.handle_event(event)
+    PROMPTS.update()
+    mouse_pos = pygame.mouse.get_pos()
+    track_scene(mouse_pos)
+    if not renderer.begin_frame():
+        scheduler.frame_skipped()
+        continue
 
     screen.fill((100, 100, 100))
     screen.blit(scaled_image_surface, left_top)
 
-    for row in grid:
-        for cell in row:
-            if cell.is_hovered(mouse_pos):
-                cell.draw(screen, border_color=(255, 255, 255), fill_color=(255, 255, 255, 80))
-            else:
-                cell.draw(screen, border_color=(255, 255, 255), fill_color=(0, 0, 0, 50))
+    grid_overlay.draw(screen, mouse_pos)
 
         # Отрисовка виджетов
     for widget in all_widgets:
         if isinstance(widget, BowSpell) and widget.visible:  
-            mx, my = pygame.mouse.get_pos()
+            mx, my = mouse_pos
             widget.draw(mx, my)
         elif isinstance(widget, LinearSpell) and widget.visible:  
-            mx, my = pygame.mouse.get_pos()
+            mx, my = mouse_pos
             widget.draw(mx, my)
         elif isinstance(widget, TriangleSpell) and widget.visible:  
-            mx, my = pygame.mouse.get_pos()
+            mx, my = mouse_pos
             widget.draw(mx, my)
         elif isinstance(widget, CircularSpell) and widget.visible:  
-            mx, my = pygame.mouse.get_pos()
+            mx, my = mouse_pos
             widget.draw(mx, my)
         else:
             try:
@@ -198,11 +290,14 @@ while running:
 
     if initiative_manager.initiatives_set:
         initiative_manager.draw_current_entity_rect(screen)
+        screen.blit(get_round_label(), round_label_pos)
     
-    prev_button.draw(screen)
-    roll_button.draw(screen)
-    next_button.draw(screen)
-    recalculate_button.draw(screen)
-    pygame.display.flip()
+    for button in buttons:
+        button.draw(screen)
+    TOOLS.draw(screen)
+    PROMPTS.draw(screen)
+    renderer.end_frame()
+    scheduler.frame_rendered()
 
+print(scheduler.report())
 pygame.quit()
@@ -3,13 +3,49 @@ from PIL import Image, ImageDraw
 import math
 import maptools
 import tkinter as tk
-from tkinter.simpledialog import askstring
 from fight_tools import Button, Toolbar
 import Gameclass
+import render_tools
+from prompt_tools import PROMPTS
+
+
+class AvatarCache:
+    """Общий кэш круглых аватаров: ключ (путь, диаметр, мёртв ли)."""
+
+    def __init__(self):
+        self._surfaces = {}
+
+    def get(self, path, diameter, is_dead=False):
+        key = (path, diameter, is_dead)
+        surface = self._surfaces.get(key)
+        if surface is None:
+            image = Image.open(path).resize((diameter, diameter))
+            surface = self._create_circular_avatar(image)
+            if pygame.display.get_surface() is not None:
+                surface = surface.convert_alpha()  # Быстрый блит в формате экрана
+            self._surfaces[key] = surface
+        return surface
+
+    @staticmethod
+    def _create_circular_avatar(image):
+        """Обрезает изображение в круг и возвращает Pygame Surface."""
+        size = image.size
+        mask = Image.new("L", size, 0)
+        draw = ImageDraw.Draw(mask)
+        draw.ellipse((0, 0, size[0], size[1]), fill=255)
+
+        circular_image = Image.new("RGBA", size)
+        circular_image.paste(image, (0, 0), mask)
+
+        return pygame.image.fromstring(circular_image.tobytes(), circular_image.size, circular_image.mode)
+
+
+AVATAR_CACHE = AvatarCache()
 
 
 class EntityWidget:
-    def __init__(self, entity, diameter, initial_x, initial_y, cell_size, map_manager, screen, spell_widgets):
+    def __init__(self, entity, diameter, initial_x, initial_y, cell_size, map_manager, screen, spell_widgets,
+                 initiative_manager=None):
         self.entity = entity
         self.diameter = diameter
         self.is_dragging = False
@@ -21,39 +57,37 @@ class EntityWidget:
         self.initial_position = (initial_x, initial_y)
         self.rect = pygame.Rect(self.initial_position[0], self.initial_position[1], cell_size, cell_size)
         self.map_manager = map_manager
-        avatar_image = Image.open(self.entity.avatar).resize((diameter, diameter))
-        self.avatar_surface = self._create_circular_avatar(avatar_image)
+        # Живой и мёртвый аватары загружаются один раз, отрисовка — только блит
+        self.alive_avatar_surface = AVATAR_CACHE.get(self.entity.avatar, diameter)
+        self.dead_avatar_surface = AVATAR_CACHE.get(self.entity.death_avatar, diameter, is_dead=True)
+        self.avatar_surface = self.alive_avatar_surface
         # Теперь займёмся генерацией тулбара
         self.toolbar = None
         self.screen = screen
         self.spell_widgets = spell_widgets
         self.is_active = self.entity.entity_type == "Player"
-        
-    def _create_circular_avatar(self, image):
-        """Обрезает изображение в круг и возвращает Pygame Surface."""
-        size = image.size
-        mask = Image.new("L", size, 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse((0, 0, size[0], size[1]), fill=255)
-
-        circular_image = Image.new("RGBA", size)
-        circular_image.paste(image, (0, 0), mask)
-
-        return pygame.image.fromstring(circular_image.tobytes(), circular_image.size, circular_image.mode)
+        # Значки HP и брони, перерисовываются только при изменении значений
+        self._badge_key = None
+        self._badge_surface = None
+        # Эффекты с длительностью подписываются под аватаром
+        self.initiative_manager = initiative_manager
         
     def draw(self, surface):
         if not self.is_active:
             return
         """Рисует виджет и тулбар (если он есть) на заданной поверхности."""
-        avatar_path = self.entity.avatar if self.entity.hp > 0 else self.entity.death_avatar
-        avatar_image = Image.open(avatar_path).resize((self.diameter, self.diameter))
-        self.avatar_surface = self._create_circular_avatar(avatar_image)
+        self.avatar_surface = self.alive_avatar_surface if self.entity.hp > 0 else self.dead_avatar_surface
 
         surface.blit(self.avatar_surface, (self.x, self.y))
         center_x, center_y = self.x + self.diameter / 2, self.y + self.diameter / 2
 
         if self.entity.entity_type != "Monster":
-            self._draw_hp_and_armor(surface, center_x, center_y)
+            badge_surface = self._get_badge_surface()
+            surface.blit(badge_surface, (self.x - self.BADGE_MARGIN, self.y - self.BADGE_MARGIN))
+
+        for i, label in enumerate(self._get_effect_labels()):
+            text = render_tools.render_text(label, self.effect_font_size(), Gameclass.CURRENT_COLOR_PRESET.button_font[:3])
+            surface.blit(text, (self.x, self.y + self.diameter + i * self.effect_font_size() * 0.8))
 
         if self.toolbar:
             self.toolbar.draw_yourself(surface)
@@ -62,6 +96,76 @@ class EntityWidget:
 
 
 
+    def get_bounds(self):
+        """Возвращает область экрана, которую занимает виджет вместе с HP/AC и тулбаром."""
+        # Значки HP и брони выступают вправо примерно на 0.2 диаметра
+        bounds = pygame.Rect(self.x, self.y, int(self.diameter * 1.25), self.diameter).inflate(4, 4)
+        labels = self._get_effect_labels()
+        if labels:
+            line_height = self.effect_font_size() * 0.8
+            bounds.union_ip(pygame.Rect(self.x, self.y + self.diameter,
+                                        max(render_tools.get_font(self.effect_font_size()).size(label)[0] for label in labels),
+                                        math.ceil(line_height * (len(labels) - 1) + self.effect_font_size())))
+        if self.toolbar:
+            bounds.unionall_ip([button.rect for button in self.toolbar.buttons])
+            if self.toolbar.sub_toolbar.isdrawn:
+                bounds.unionall_ip([button.rect for button in self.toolbar.sub_toolbar.buttons])
+        return bounds
+
+    def get_hit_rects(self):
+        """Прямоугольники, по которым виджет ловит клики: аватар и кнопки тулбара."""
+        if not self.is_active:
+            return []
+        rects = [self.rect]
+        if self.toolbar:
+            rects.extend(button.rect for button in self.toolbar.buttons)
+            if self.toolbar.sub_toolbar.isdrawn:
+                rects.extend(button.rect for button in self.toolbar.sub_toolbar.buttons)
+        return rects
+
+    def get_render_state(self):
+        """Значения, изменение которых требует перерисовать виджет."""
+        toolbar_state = None
+        if self.toolbar:
+            toolbar_state = (self.toolbar.sub_toolbar.isdrawn,
+                             tuple(button.is_pressed for button in self.toolbar.buttons),
+                             tuple(button.is_pressed for button in self.toolbar.sub_toolbar.buttons))
+        return (self.is_active, self.entity.hp, self.entity.armor_class, toolbar_state, self._get_effect_labels())
+
+    # Сколько эффектов подписывать под аватаром, остальные сворачиваются в "+N"
+    MAX_EFFECT_LABELS = 3
+
+    def effect_font_size(self):
+        return max(12, int(self.diameter * 0.35))
+
+    def _get_effect_labels(self):
+        """Подписи вида "Bless 3" для эффектов на сущности."""
+        if self.initiative_manager is None or not self.is_active:
+            return ()
+        effects = self.initiative_manager.effects_on(self.entity)
+        labels = [f"{effect.name} {self.initiative_manager.remaining_rounds(effect)}"
+                  for effect in effects[:self.MAX_EFFECT_LABELS]]
+        if len(effects) > self.MAX_EFFECT_LABELS:
+            labels.append(f"+{len(effects) - self.MAX_EFFECT_LABELS}")
+        return tuple(labels)
+
+    # Отступ поверхности значков от угла виджета под толщину обводок
+    BADGE_MARGIN = 2
+
+    def _get_badge_surface(self):
+        """Возвращает поверхность со значками HP и брони, перерисовывая её при изменении HP/AC."""
+        preset = Gameclass.CURRENT_COLOR_PRESET
+        key = (self.entity.hp, self.entity.armor_class, self.diameter,
+               preset.hp_fill, preset.hp_border, preset.armor_border)
+        if key != self._badge_key:
+            margin = self.BADGE_MARGIN
+            self._badge_surface = pygame.Surface((int(self.diameter * 1.25) + 2 * margin, self.diameter + 2 * margin),
+                                                 pygame.SRCALPHA)
+            center = self.diameter / 2 + margin
+            self._draw_hp_and_armor(self._badge_surface, center, center)
+            self._badge_key = key
+        return self._badge_surface
+
     def _draw_hp_and_armor(self, surface, center_x, center_y):
         """Отдельный метод для отрисовки HP и Armor."""
         square_side = (math.sqrt(3) / 4) * self.diameter
@@ -76,11 +180,11 @@ class EntityWidget:
             square_color = Gameclass.CURRENT_COLOR_PRESET.hp_fill
             border_color = Gameclass.CURRENT_COLOR_PRESET.hp_border
         
-        pygame.draw.rect(surface, square_color, hp_rect)  # Основной квадрат
-        pygame.draw.rect(surface, border_color, hp_rect, width=2)  # Обводка
+        # Значки непрозрачные, как при рисовании прямо на экран
+        pygame.draw.rect(surface, square_color[:3], hp_rect)  # Основной квадрат
+        pygame.draw.rect(surface, border_color[:3], hp_rect, width=2)  # Обводка
         
-        font = pygame.font.Font(None, int(0.95 * square_side))  # Размер шрифта для ХП
-        hp_text = font.render(str(self.entity.hp), True, (0, 0, 0))
+        hp_text = render_tools.render_text(self.entity.hp, 0.95 * square_side, (0, 0, 0))  # Размер шрифта для ХП
         text_rect = hp_text.get_rect(center=hp_rect.center)
         surface.blit(hp_text, text_rect)
 
@@ -103,12 +207,11 @@ class EntityWidget:
         penta_color = Gameclass.CURRENT_COLOR_PRESET.armor_border
         penta_border_color = Gameclass.CURRENT_COLOR_PRESET.armor_border
         
-        pygame.draw.polygon(surface, penta_color, pentagon_points)
-        pygame.draw.polygon(surface, penta_border_color, pentagon_points, width=2)
+        pygame.draw.polygon(surface, penta_color[:3], pentagon_points)
+        pygame.draw.polygon(surface, penta_border_color[:3], pentagon_points, width=2)
 
         # Рисуем текст armor_class
-        font = pygame.font.Font(None, int(0.5 * self.diameter))  # Меньший шрифт
-        ac_text = font.render(str(self.entity.armor_class), True, (0, 0, 0))
+        ac_text = render_tools.render_text(self.entity.armor_class, 0.5 * self.diameter, (0, 0, 0))  # Меньший шрифт
         ac_rect = ac_text.get_rect(center=(pentagon_x0, pentagon_y0 + pentagon_height / 2))
         surface.blit(ac_text, ac_rect)
 
@@ -229,17 +332,41 @@ class EntityWidget:
 
 
 
+    def open_effect_window(self):
+        """Спрашивает название и длительность эффекта. Длительность 0 снимает эффекты с таким названием."""
+        if self.initiative_manager is None:
+            return
+
+        def on_name(name):
+            name = name.strip()
+            if name:
+                PROMPTS.ask(f"{name}: rounds (0 removes)", lambda rounds: on_rounds(name, rounds))
+
+        def on_rounds(name, rounds):
+            try:
+                rounds = int(rounds)
+            except ValueError:
+                return
+            if rounds > 0:
+                self.initiative_manager.add_effect(self.entity, name, rounds)
+            else:
+                for effect in self.initiative_manager.effects_on(self.entity):
+                    if effect.name == name:
+                        self.initiative_manager.remove_effect(effect)
+
+        PROMPTS.ask(f"Effect on {self.entity.name}:", on_name, numeric=False)
+
+
 #######################################################################################
 
     
     def handle_event(self, event):
+        """Обрабатывает события мыши для перетаскивания или клика правой кнопкой."""
         if not self.is_active:
             return
-            
-        self.update_position()
-        """Обрабатывает события мыши для перетаскивания или клика правой кнопкой."""
-        
+
         if event.type == pygame.MOUSEBUTTONDOWN:
+            self.update_position()
             mouse_x, mouse_y = event.pos
             
             # Проверяем, нажата ли левая кнопка мыши и находится ли курсор внутри виджета
@@ -264,6 +391,8 @@ class EntityWidget:
             elif event.button == 3 and self.rect.collidepoint(mouse_x, mouse_y):
                 if pygame.key.get_mods() & pygame.KMOD_SHIFT:
                     self.open_stat_adjustment_window()
+                elif pygame.key.get_mods() & pygame.KMOD_CTRL:
+                    self.open_effect_window()
                 else:
                     if self.toolbar:
                         self.toolbar = None
@@ -290,8 +419,8 @@ class EntityWidget:
                 self.map_manager.remove_entity_by_value(self.entity)
                 if event.button == 1 and self.rect.collidepoint(mouse_x, mouse_y):
                     self.snap_to_cell(mouse_x, mouse_y)
-                    self.update_position()
                     self.update_toolbar_position()
+                self.update_position()
                 self.is_dragging = False
 
 
@@ -2,63 +2,82 @@ import pygame
 import pygame.gfxdraw
 import sys
 import numpy as np
-import tkinter as tk
-from tkinter import filedialog, messagebox
-from tkinter.simpledialog import askstring
 from math import floor, sqrt, atan2, cos, sin, radians, degrees
 import math
 import Gameclass
+import maptools
+import render_tools
+import dice
+from prompt_tools import PROMPTS
 
-def input_box_tk(prompt):
-    root = tk.Tk()
-    root.geometry("0x0")  # Делаем окно невидимым
-    root.overrideredirect(1)  # Убираем заголовок окна
+def resolve_hits(caster, enemies_hit, on_done):
     """
-    Окно ввода с использованием tkinter.
-    Возвращает введенное значение.
+    Определяет, по кому из целей прошла атака и сколько урона она нанесла.
+
+    Если у атакующего монстра заданы бонус атаки и урон, броски делаются автоматически,
+    по одной атаке на цель за один вызов NumPy. Иначе бросок и урон спрашиваются у мастера
+    в окне игры: один бросок против всех целей и один урон для всех попавших.
+    Ввод не блокирует главный цикл, поэтому результат передаётся в on_done.
+
+    :param caster: Атакующая сущность (может быть None)
+    :param enemies_hit: Список (entity, row, col)
+    :param on_done: Вызывается со списком (entity, row, col, damage) попавших атак;
+                    при промахе — с пустым списком, при отмене не вызывается
     """
-    root.withdraw()  
-    root.attributes("-topmost", True)
-    result = askstring("Input", prompt)
-    root.attributes("-topmost", False)  # Снять приоритет
-    root.deiconify()  # Вернуть окно tkinter
-    root.destroy()
-    return result
-
-def message_box(message):
-    root = tk.Tk()
-    root.withdraw()
-    def close_window(event=None):
-        custom_window.destroy()
-    title = ''
-    custom_window = tk.Toplevel()
-    custom_window.title(title)
-    custom_window.geometry("100x70")
-    custom_window.resizable(False, False)
-
-    # Центрируем окно на экране
-    custom_window.update_idletasks()
-    width = custom_window.winfo_width()
-    height = custom_window.winfo_height()
-    x = (custom_window.winfo_screenwidth() // 2) - (width // 2)
-    y = (custom_window.winfo_screenheight() // 2) - (height // 2)
-    custom_window.geometry(f"{width}x{height}+{x}+{y}")
-
-    # Сообщение
-    label = tk.Label(custom_window, text=message, padx=10, pady=10)
-    label.pack()
-    button = tk.Button(custom_window, text="OK", command=close_window)
-    button.pack()
-    custom_window.bind("<Return>", close_window)
-    custom_window.focus_force()
-    custom_window.transient()  # Устанавливаем как модальное окно
-    custom_window.grab_set()  # Захватываем фокус
-    # Ожидание действия пользователя
-    custom_window.transient()  # Устанавливаем как модальное окно
-    custom_window.grab_set()  # Захватываем фокус
-    custom_window.wait_window(custom_window)
-    root.destroy()
+    if not enemies_hit:
+        on_done([])
+        return
+    if dice.can_auto_attack(caster):
+        result = dice.resolve_attacks(caster.attack_bonus, caster.damage,
+                                      [enemy.armor_class for enemy, _, _ in enemies_hit])
+        hits = []
+        for (enemy, row, col), natural, total, hit, crit, damage in zip(
+                enemies_hit, result["natural"].tolist(), result["total"].tolist(), result["hit"].tolist(),
+                result["crit"].tolist(), result["damage"].tolist()):
+            print(f"{caster.name} -> {enemy.name}: d20={natural}, total={total} vs AC {enemy.armor_class}, "
+                  f"{'crit ' if crit else ''}{'hit for ' + str(damage) if hit else 'miss'}")
+            if hit:
+                hits.append((enemy, row, col, damage))
+        PROMPTS.toast(f"Попадание! Урон: {sum(hit[3] for hit in hits)}" if hits else 'Промах!')
+        on_done(hits)
+        return
+
+    def on_roll(roll_input):
+        if not roll_input.isdigit():
+            return
+        roll = int(roll_input)
+        # Фильтруем, кого можно атаковать
+        successful_hits = [(enemy, row, col) for enemy, row, col in enemies_hit if roll >= enemy.armor_class]
+        if not successful_hits:
+            PROMPTS.toast("Промах!")
+            on_done([])
+            return
+        PROMPTS.toast('Попадание!')
+
+        def on_damage(damage_input):
+            if not damage_input.isdigit():
+                return
+            damage = int(damage_input)
+            on_done([(enemy, row, col, damage) for enemy, row, col in successful_hits])
+
+        PROMPTS.ask("Enter damage", on_damage)
 
+    PROMPTS.ask("Enter roll", on_roll)
+
+
+def attack_summary(analyses):
+    """
+    Краткая сводка по анализу атак: шанс и средний урон по одной цели
+    или ожидаемое число попаданий и суммарный урон по нескольким.
+    """
+    if not analyses:
+        return None
+    if len(analyses) == 1:
+        analysis = analyses[0]
+        return f"Hit {analysis.hit_chance:.0%} (crit {analysis.crit_chance:.0%}), avg {analysis.expected_damage:.1f} dmg"
+    expected_hits = sum(analysis.hit_chance for analysis in analyses)
+    expected_damage = sum(analysis.expected_damage for analysis in analyses)
+    return f"{len(analyses)} targets: ~{expected_hits:.1f} hits, avg {expected_damage:.1f} dmg total"
 
 
 class SpellWidget:
@@ -74,9 +93,134 @@ class SpellWidget:
         self.offset_y = 0  # Смещение по y для таскания из центра
         self.dropped_position = (self.x, self.y)  # Координаты последнего дропа
         self.map_manager = map_manager
+        self.caster = None  # Сущность, применяющая заклинание; задаётся тулбаром
         self.fillingcol = Gameclass.CURRENT_COLOR_PRESET.player_spells_fill
         self.bordercol = Gameclass.CURRENT_COLOR_PRESET.player_spells_border
         self.iconic_path = ['arrow.png', 'flow.png', 'spray.png', 'explosion.png']
+        self._asking = False  # Ждём ответа на запрос размеров заклинания
+        self._reset_highlight()
+
+    def _ask_sizes(self, prompts, apply):
+        """
+        Запрашивает размеры заклинания по очереди, не блокируя отрисовку.
+        Когда все числа введены, вызывает apply(*числа) и помечает заклинание готовым;
+        Esc или нечисловой ответ убирают заклинание, на число меньше 1 запрос повторяется.
+        """
+        if self._asking:
+            return
+        self._asking = True
+        values = []
+
+        def cancel():
+            self._asking = False
+            self.delete()
+
+        def on_value(text):
+            if not self.visible:
+                self._asking = False
+                return
+            try:
+                value = int(text)
+            except ValueError:
+                cancel()
+                return
+            if value < 1:
+                # Нулевой или отрицательный размер не отрисовать: smoothscale падает на отрицательных размерах
+                PROMPTS.toast("Размер должен быть не меньше 1")
+                PROMPTS.ask(prompts[len(values)], on_value, on_cancel=cancel)
+                return
+            values.append(value)
+            if len(values) < len(prompts):
+                PROMPTS.ask(prompts[len(values)], on_value, on_cancel=cancel)
+            else:
+                self._asking = False
+                apply(*values)
+                self.initialized = True
+
+        PROMPTS.ask(prompts[0], on_value, on_cancel=cancel)
+
+    def _apply_hits(self, hits):
+        """Записывает урон попавших атак в таблицу урона карты."""
+        self.map_manager.set_damage_cells((row, col, damage) for _, row, col, damage in hits)
+
+    def _reset_highlight(self):
+        """Сбрасывает подсветку задетых клеток."""
+        self._highlight_state = None
+        self.highlight_cells = []  # Клетки, которые заденет заклинание
+        self.highlight_hits = []  # Сущности в этих клетках: (entity, row, col)
+        self._highlight_surface = None
+        self._highlight_rect = None
+        self.highlight_analysis = []  # dice.AttackAnalysis для каждой цели из highlight_hits
+        self._summary_surface = None
+        self._summary_rect = None
+
+    def _highlight_key(self, x, y):
+        """
+        Ключ, при смене которого подсветку нужно пересчитать (клетка, размеры, корзина угла).
+        None — подсветки нет.
+        """
+        return None
+
+    def _highlight_query(self, key):
+        """Возвращает клетки области поражения для ключа подсветки."""
+        return []
+
+    def _refresh_highlight(self, x, y):
+        """Пересчитывает подсветку, только если курсор перешёл в другую клетку или корзину угла."""
+        key = self._highlight_key(x, y)
+        state = (key, self.caster) if key is not None else None
+        if state == self._highlight_state:
+            return
+        self._highlight_state = state
+        self.highlight_cells = self._highlight_query(key) if key is not None else []
+        self.highlight_hits = self.map_manager.occupied_in_mask(self.map_manager.cells_mask(self.highlight_cells))
+        self.highlight_analysis = dice.analyze_targets(self.caster, [enemy for enemy, _, _ in self.highlight_hits])
+        self._highlight_surface, self._highlight_rect = None, None
+        self._summary_surface, self._summary_rect = None, None
+        if not self.highlight_cells:
+            return
+
+        # Вся подсветка собирается в одну поверхность и дальше рисуется одним блитом
+        cell_rects = [self.map_manager.cell_rect(row, col) for row, col in self.highlight_cells]
+        bounds = cell_rects[0].unionall(cell_rects[1:])
+        surface = pygame.Surface(bounds.size, pygame.SRCALPHA)
+        fill_color = (*self.bordercol[:3], 60)
+        for rect in cell_rects:
+            surface.fill(fill_color, rect.move(-bounds.x, -bounds.y))
+        for _, row, col in self.highlight_hits:
+            hit_rect = self.map_manager.cell_rect(row, col).move(-bounds.x, -bounds.y)
+            pygame.draw.rect(surface, (*self.bordercol[:3], 255), hit_rect, 3)
+        # Шанс попадания подписывается прямо на клетке цели
+        for (_, row, col), analysis in zip(self.highlight_hits, self.highlight_analysis):
+            hit_rect = self.map_manager.cell_rect(row, col).move(-bounds.x, -bounds.y)
+            label = render_tools.render_text(f"{analysis.hit_chance:.0%}", max(14, self.cell_size * 0.35), (255, 255, 255))
+            surface.blit(label, label.get_rect(midtop=(hit_rect.centerx, hit_rect.top + 3)))
+        self._highlight_surface, self._highlight_rect = surface, bounds
+
+        summary = attack_summary(self.highlight_analysis)
+        if summary:
+            self._summary_surface = render_tools.render_text(summary, 24, (255, 255, 255))
+            self._summary_rect = self._summary_surface.get_rect(topleft=bounds.bottomleft)
+            if self._summary_rect.bottom > self.screen.get_height():
+                self._summary_rect.bottomleft = bounds.topleft
+
+    def draw_highlight(self, x, y):
+        """Рисует задетые клетки и цели под превью."""
+        self._refresh_highlight(x, y)
+        if self._highlight_surface is not None:
+            self.screen.blit(self._highlight_surface, self._highlight_rect.topleft)
+        if self._summary_surface is not None:
+            self.screen.blit(self._summary_surface, self._summary_rect.topleft)
+
+    def _with_highlight_bounds(self, bounds, x, y):
+        """Расширяет область превью на подсвеченные клетки."""
+        self._refresh_highlight(x, y)
+        if bounds is None or self._highlight_rect is None:
+            return bounds
+        bounds = bounds.union(self._highlight_rect)
+        if self._summary_rect is not None:
+            bounds.union_ip(self._summary_rect)
+        return bounds
 
     def draw(self, x, y):
         if self.visible:  # Отрисовываем только если видим
@@ -86,6 +230,13 @@ class SpellWidget:
             center = self.rect.center
             pygame.gfxdraw.filled_circle(self.screen, center[0], center[1], radius, self.fillingcol)
             pygame.gfxdraw.aacircle(self.screen, center[0], center[1], radius, self.bordercol)
+
+    def get_bounds(self, x, y):
+        """
+        Возвращает область экрана, которую займёт превью при курсоре в (x, y).
+        None означает, что размер превью пока неизвестен.
+        """
+        return self.rect.inflate(2, 2)
             
     def snap_to_cell(self, mouse_x, mouse_y):
         # Проверяем, что координаты внутри границ карты
@@ -106,6 +257,7 @@ class SpellWidget:
         self.visible = False
         self.rect.topleft = (0, 0)
         self.dragging = False
+        self._reset_highlight()
         # Сбрасываем флаг инициализации
     
         # Обнуляем специфические параметры для каждого заклинания
@@ -151,26 +303,47 @@ class SpellWidget:
 
 
 class BowSpell(SpellWidget):
+    # Готовые полупрозрачные спрайты стрелы по размеру клетки
+    _arrow_sprites = {}
+
     def __init__(self, screen, x, y, cell_size, map_manager):
         super().__init__(screen, x, y, cell_size, map_manager)
         self.dragging = False  # НЕ в режиме перетаскивания при создании
 
+    def _get_arrow_sprite(self):
+        """Возвращает спрайт стрелы для текущего размера клетки, создавая его один раз."""
+        sprite = self._arrow_sprites.get(self.cell_size)
+        if sprite is None:
+            arrow_image = pygame.image.load(self.iconic_path[0]).convert()
+            arrow_image.set_colorkey((255, 255, 255))
+            arrow_image = arrow_image.convert_alpha()
+            sprite = pygame.transform.smoothscale(arrow_image, (self.cell_size, self.cell_size))
+            # Ограничиваем прозрачность сразу для всех пикселей
+            alpha = pygame.surfarray.pixels_alpha(sprite)
+            np.minimum(alpha, 120, out=alpha)
+            del alpha  # Освобождаем блокировку поверхности
+            self._arrow_sprites[self.cell_size] = sprite
+        return sprite
+
     def draw(self, x, y):
         """Рисует стрелу вокруг курсора, если она активна."""
         if self.visible:
             self.rect.center = (x, y)
-            arrow_image = pygame.image.load(self.iconic_path[0]).convert()
-            arrow_image.set_colorkey((255, 255, 255))
-            arrow_image = arrow_image.convert_alpha()
-            scaled_size = (self.cell_size, self.cell_size)
-            arrow_image = pygame.transform.smoothscale(arrow_image, scaled_size)
-            for i in range(scaled_size[0]):
-                for j in range(scaled_size[1]):
-                    r, g, b, a = arrow_image.get_at((i, j))
-                    arrow_image.set_at((i, j), (r, g, b, min(a, 120)))  # Ограничиваем прозрачность
+            arrow_image = self._get_arrow_sprite()
             image_rect = arrow_image.get_rect(center=self.rect.center)
+            self.draw_highlight(x, y)
             self.screen.blit(arrow_image, image_rect.topleft)
 
+    def get_bounds(self, x, y):
+        bounds = pygame.Rect(0, 0, self.cell_size, self.cell_size)
+        bounds.center = (x, y)
+        return self._with_highlight_bounds(bounds.inflate(2, 2), x, y)
+
+    def _highlight_key(self, x, y):
+        return self.map_manager._get_cell_indices(x, y)
+
+    def _highlight_query(self, key):
+        return [key]
 
     def handle_event(self, event):
         if not self.visible:
@@ -205,23 +378,21 @@ class BowSpell(SpellWidget):
         if enemy is None:
             return
         
-        roll_input = input_box_tk("Enter roll")
-        armor_class = enemy.armor_class
-        if roll_input and roll_input.isdigit():
-            roll = int(roll_input)
-            if roll >= armor_class:
-                message_box('Попадание!')
-                damage_input = input_box_tk("Enter damage")
-                if damage_input and damage_input.isdigit():
-                    damage = int(damage_input)
-                    self.map_manager.set_damage(mx, my, damage)
-            else:
-                message_box('Промах!')
+        resolve_hits(self.caster, [(enemy, row, col)], self._apply_hits)
 
 
 
 
 class LinearSpell(SpellWidget):
+    # Шаг квантования угла поворота превью, градусы
+    ANGLE_STEP = 1
+    # Повёрнутые спрайты по ключу (длина, корзина угла); статистика доступна через sprite_cache.stats().
+    # Спрайт длинной линии на крупных клетках весит несколько МБ, поэтому кэш ограничен по байтам
+    sprite_cache = render_tools.SpriteCache(max_size=720, max_bytes=64 * 1024 * 1024)
+    # Растянутые по длине, но ещё не повёрнутые спрайты
+    _scaled_cache = render_tools.SpriteCache(max_size=16, max_bytes=32 * 1024 * 1024)
+    _flow_image = None
+
     def __init__(self, screen, x, y, cell_size, map_manager):
         super().__init__(screen, x, y, cell_size, map_manager)
         self.length = 0
@@ -229,78 +400,84 @@ class LinearSpell(SpellWidget):
         self.angle = 0  # Угол поворота
         self.dragging = False  
         
+    def _set_length(self, length):
+        self.length = length
+
     def draw(self, x, y):
         if self.visible:
             if not self.initialized:
-                try:
-                    self.length = int(input_box_tk("Enter length"))
-                    self.initialized = True
-                except (TypeError, ValueError):
-                    self.initialized, self.visible = False, False
-                    return
+                self._ask_sizes(["Enter length"], self._set_length)
+                return
             dx = x - self.x
             dy = y - self.y
             self.angle = atan2(dy, dx)  # Сохраняем угол для атаки
-            abs_length = (self.length + 0.5) * self.cell_size
-            width = self.cell_size * 0.5
-            center_x = self.x + cos(self.angle) * abs_length / 2
-            center_y = self.y + sin(self.angle) * abs_length / 2
-            flow_image = pygame.image.load(self.iconic_path[1]).convert()
-            flow_image.set_colorkey((255, 255, 255))
-            flow_image = flow_image.convert_alpha()
-            scaled_size = (abs_length, width)  # Масштабируем по длине и ширине
-            flow_image = pygame.transform.smoothscale(flow_image, scaled_size)
-            rotated_flow_image = pygame.transform.rotate(flow_image, -degrees(self.angle))
+            abs_length = int((self.length + 0.5) * self.cell_size)
+            # Превью рисуется по квантованному углу, чтобы спрайты переиспользовались
+            angle_bucket = round(degrees(self.angle) / self.ANGLE_STEP) % round(360 / self.ANGLE_STEP)
+            preview_angle = radians(angle_bucket * self.ANGLE_STEP)
+            center_x = self.x + cos(preview_angle) * abs_length / 2
+            center_y = self.y + sin(preview_angle) * abs_length / 2
+            rotated_flow_image = self.sprite_cache.get(
+                (abs_length, self.cell_size, angle_bucket),
+                lambda: pygame.transform.rotate(self._get_scaled_flow(abs_length), -angle_bucket * self.ANGLE_STEP)
+            )
             flow_rect = rotated_flow_image.get_rect(center=(center_x, center_y))
+            self.draw_highlight(x, y)
             self.screen.blit(rotated_flow_image, flow_rect.topleft)
 
+    def _highlight_key(self, x, y):
+        if not self.initialized:
+            return None
+        origin = self.map_manager._get_cell_indices(self.x, self.y)
+        if origin is None:
+            return None
+        return origin, self.length, maptools.STENCILS.quantize_angle(atan2(y - self.y, x - self.x))
+
+    def _highlight_query(self, key):
+        (row, col), length, angle_bucket = key
+        return self.map_manager.line_cells(row, col, length, radians(angle_bucket * maptools.STENCILS.angle_step))
+
+    def _get_scaled_flow(self, abs_length):
+        """Спрайт потока, растянутый по длине линии (до поворота)."""
+        def build():
+            if LinearSpell._flow_image is None:
+                flow_image = pygame.image.load(self.iconic_path[1]).convert()
+                flow_image.set_colorkey((255, 255, 255))
+                LinearSpell._flow_image = flow_image.convert_alpha()
+            width = int(self.cell_size * 0.5)
+            return pygame.transform.smoothscale(LinearSpell._flow_image, (abs_length, width))  # Масштабируем по длине и ширине
+        return self._scaled_cache.get((abs_length, self.cell_size), build)
+
+    def get_bounds(self, x, y):
+        if not self.initialized:
+            return None
+        # Повёрнутая полоса целиком помещается в квадрат со стороной длина + ширина
+        abs_length = (self.length + 0.5) * self.cell_size
+        angle = atan2(y - self.y, x - self.x)
+        side = int(abs_length + self.cell_size * 0.5) + 4
+        bounds = pygame.Rect(0, 0, side, side)
+        bounds.center = (self.x + cos(angle) * abs_length / 2, self.y + sin(angle) * abs_length / 2)
+        return self._with_highlight_bounds(bounds, x, y)
 
 
     def attack(self):
         """Проводит атаку по всем врагам в линии (кроме клетки с магом)"""
-        enemies_hit = []
-    
         # Получаем клеточные координаты мага
-        start_x = round(self.x / self.cell_size)
-        start_y = round(self.y / self.cell_size)
-    
-        # Вычисляем шаги вдоль линии в координатах сетки, начиная со следующей клетки
-        for i in range(1, self.length + 1):
-            check_x = self.x + cos(self.angle) * i * self.cell_size
-            check_y = self.y + sin(self.angle) * i * self.cell_size
-
-            enemy = self.map_manager.get_entity(check_x, check_y)
-            if enemy:
-                enemies_hit.append((enemy, check_x, check_y))
+        origin = self.map_manager._get_cell_indices(self.x, self.y)
+        if origin is None:
+            return
+        enemies_hit = self.map_manager.query_line(*origin, self.length, self.angle)
         
         if not enemies_hit:
             return  
     
-        roll_input = input_box_tk("Enter roll")
-        if not roll_input or not roll_input.isdigit():
-            return  
-        roll = int(roll_input)
-    
-        # Фильтруем, кого можно атаковать
-        successful_hits = [(enemy, x, y) for enemy, x, y in enemies_hit if roll >= enemy.armor_class]
-    
-        if not successful_hits:
-            message_box("Промах!")
-            return
-    
-        damage_input = input_box_tk("Enter damage")
-        if not damage_input or not damage_input.isdigit():
-            return
-        damage = int(damage_input)
-    
-        for _, x, y in successful_hits:
-            self.map_manager.set_damage(x, y, damage)
+        resolve_hits(self.caster, enemies_hit, self._apply_hits)
 
 
 
     def handle_event(self, event):
         """Обрабатывает ввод игрока"""
-        if not self.visible:
+        if not self.visible or not self.initialized:  # Пока вводятся размеры, клики не считаются
             return
 
         if event.type == pygame.MOUSEMOTION and self.dragging:
@@ -326,50 +503,98 @@ class TriangleSpell(SpellWidget):
         self.angle = 0  # Угол поворота
         self.dragging = False
         self.image = pygame.image.load('spray.png').convert_alpha()
+        self._scratch = None  # Переиспользуемая поверхность под превью конуса
+
+    def _set_sizes(self, height, base):
+        self.height = height
+        self.base = base
 
     def draw(self, x, y):
         if self.visible:
             if not self.initialized:
-                try:
-                    self.height = int(input_box_tk("Enter height"))
-                    self.base = int(input_box_tk("Enter base"))
-                    self.initialized = True
-                except (TypeError, ValueError):
-                    self.initialized, self.visible = False, False
-                    return
+                self._ask_sizes(["Enter height", "Enter base"], self._set_sizes)
+                return
 
             dx = x - self.x
             dy = y - self.y
             self.angle = atan2(dy, dx)  # Угол в радианах
+            self.triangle_points = self._triangle_points(self.angle)
 
-            # Координаты вершины треугольника (закреплены на маге)
-            top_x, top_y = self.x, self.y
-            
-            # Вычисляем координаты основания
-            base_half = (self.base * self.cell_size) / 2
-            base_center_x = self.x + cos(self.angle) * self.height * self.cell_size
-            base_center_y = self.y + sin(self.angle) * self.height * self.cell_size
-            
-            left_x = base_center_x + sin(self.angle) * base_half
-            left_y = base_center_y - cos(self.angle) * base_half
-            right_x = base_center_x - sin(self.angle) * base_half
-            right_y = base_center_y + cos(self.angle) * base_half
-
-            self.triangle_points = [(top_x, top_y), (left_x, left_y), (right_x, right_y)]
+            self.draw_highlight(x, y)
 
-            triangle_surface = pygame.Surface(self.screen.get_size(), pygame.SRCALPHA)
+            # Рисуем только в пределах ограничивающего прямоугольника конуса
+            bounds = self._points_bounds(self.triangle_points)
+            triangle_surface = self._get_scratch(bounds.size)
+            triangle_surface.fill((0, 0, 0, 0))
+            local_points = [(px - bounds.x, py - bounds.y) for px, py in self.triangle_points]
 
             # Рисуем обводку
-            pygame.draw.polygon(triangle_surface, self.bordercol, self.triangle_points, width=3)
+            pygame.draw.polygon(triangle_surface, self.bordercol, local_points, width=3)
 
             # Рисуем заливку
-            pygame.draw.polygon(triangle_surface, self.fillingcol, self.triangle_points)
+            pygame.draw.polygon(triangle_surface, self.fillingcol, local_points)
 
             # Накладываем на экран
-            self.screen.blit(triangle_surface, (0, 0))
+            self.screen.blit(triangle_surface, bounds.topleft)
+
+    def _get_scratch(self, size):
+        """
+        Возвращает прозрачную поверхность размера size из общего буфера.
+        Буфер только растёт, поэтому при движении мыши новых выделений памяти нет.
+        """
+        width, height = size
+        if self._scratch is None or self._scratch.get_width() < width or self._scratch.get_height() < height:
+            old_width, old_height = self._scratch.get_size() if self._scratch else (0, 0)
+            self._scratch = pygame.Surface((max(width, old_width), max(height, old_height)), pygame.SRCALPHA)
+        return self._scratch.subsurface((0, 0, width, height))
+
+    @staticmethod
+    def _points_bounds(points):
+        """Ограничивающий прямоугольник вершин с запасом под толщину обводки."""
+        min_x = min(p[0] for p in points)
+        min_y = min(p[1] for p in points)
+        max_x = max(p[0] for p in points)
+        max_y = max(p[1] for p in points)
+        return pygame.Rect(min_x, min_y, max_x - min_x + 1, max_y - min_y + 1).inflate(8, 8)
+
+    def _triangle_points(self, angle):
+        """Вершины конуса для заданного угла."""
+        # Координаты вершины треугольника (закреплены на маге)
+        top_x, top_y = self.x, self.y
+
+        # Вычисляем координаты основания
+        base_half = (self.base * self.cell_size) / 2
+        base_center_x = self.x + cos(angle) * self.height * self.cell_size
+        base_center_y = self.y + sin(angle) * self.height * self.cell_size
+
+        left_x = base_center_x + sin(angle) * base_half
+        left_y = base_center_y - cos(angle) * base_half
+        right_x = base_center_x - sin(angle) * base_half
+        right_y = base_center_y + cos(angle) * base_half
+
+        return [(top_x, top_y), (left_x, left_y), (right_x, right_y)]
+
+    def get_bounds(self, x, y):
+        if not self.initialized:
+            return None
+        bounds = self._points_bounds(self._triangle_points(atan2(y - self.y, x - self.x)))
+        return self._with_highlight_bounds(bounds, x, y)
+
+    def _highlight_key(self, x, y):
+        if not self.initialized:
+            return None
+        origin = self.map_manager._get_cell_indices(self.x, self.y)
+        if origin is None:
+            return None
+        return origin, self.height, self.base, maptools.STENCILS.quantize_angle(atan2(y - self.y, x - self.x))
+
+    def _highlight_query(self, key):
+        (row, col), height, base, angle_bucket = key
+        mask = self.map_manager.cone_mask(row, col, height, base, radians(angle_bucket * maptools.STENCILS.angle_step))
+        return [tuple(cell) for cell in np.argwhere(mask).tolist()]
 
     def handle_event(self, event):
-        if not self.visible:
+        if not self.visible or not self.initialized:  # Пока вводятся размеры, клики не считаются
             return
 
         if event.type == pygame.MOUSEMOTION and self.dragging:
@@ -385,118 +610,90 @@ class TriangleSpell(SpellWidget):
                 self.delete()
 
     def attack(self):
-        enemies_hit = []
-        
-        min_x = int(min(p[0] for p in self.triangle_points))
-        max_x = int(max(p[0] for p in self.triangle_points))
-        min_y = int(min(p[1] for p in self.triangle_points))
-        max_y = int(max(p[1] for p in self.triangle_points))
-        
-        for check_x in np.arange(min_x, max_x, self.cell_size):
-            for check_y in np.arange(min_y, max_y, self.cell_size):
-                if self.is_inside_triangle((check_x, check_y)) and (check_x, check_y) != (self.x, self.y):
-                    enemy = self.map_manager.get_entity(check_x, check_y)
-                    if enemy:
-                        enemies_hit.append((enemy, check_x, check_y))
+        # Клетка задета, если её центр внутри конуса; клетка мага не задевается
+        origin = self.map_manager._get_cell_indices(self.x, self.y)
+        if origin is None:
+            return
+        enemies_hit = self.map_manager.query_cone(*origin, self.height, self.base, self.angle)
 
         if not enemies_hit:
             return  
             
         print(enemies_hit)
-        enemies_hit = enemies_hit[:-1]
-        roll_input = input_box_tk("Enter roll")
-        if not roll_input or not roll_input.isdigit():
-            return  
-        roll = int(roll_input)
-
-        successful_hits = [(enemy, x, y) for enemy, x, y in enemies_hit if roll >= enemy.armor_class]
-        
-        if not successful_hits:
-            message_box("Промах!")
-            return
-
-        damage_input = input_box_tk("Enter damage")
-        if not damage_input or not damage_input.isdigit():
-            return
-        damage = int(damage_input)
-
-        for _, x, y in successful_hits:
-            self.map_manager.set_damage(x, y, damage)
-
-    def is_inside_triangle(self, point):
-        def sign(p1, p2, p3):
-            return (p1[0] - p3[0]) * (p2[1] - p3[1]) - (p2[0] - p3[0]) * (p1[1] - p3[1])
-        
-        def check_point(p):
-            px, py = p
-            v1, v2, v3 = self.triangle_points
-            d1 = sign((px, py), v1, v2)
-            d2 = sign((px, py), v2, v3)
-            d3 = sign((px, py), v3, v1)
-            
-            has_neg = (d1 < 0) or (d2 < 0) or (d3 < 0)
-            has_pos = (d1 > 0) or (d2 > 0) or (d3 > 0)
-            
-            return not (has_neg and has_pos)
-        
-        px, py = point
-        r = self.cell_size / 2
-        
-        # Генерируем точки по окружности + саму точку
-        check_points = [(px, py)]  # Исходная точка
-        for angle in range(0, 360, 45):  # Берем 8 точек по кругу
-            rad = math.radians(angle)
-            x_offset = r * math.cos(rad)
-            y_offset = r * math.sin(rad)
-            check_points.append((px + x_offset, py + y_offset))
-        
-        # Если хотя бы одна из точек попадает в треугольник, возвращаем True
-        return any(check_point(p) for p in check_points)
+        resolve_hits(self.caster, enemies_hit, self._apply_hits)
 
 
 
 class CircularSpell(SpellWidget):
+    # Готовые полупрозрачные спрайты взрыва по ключу (радиус, размер клетки)
+    sprite_cache = render_tools.SpriteCache(max_size=8)
+    _explosion_image = None
+
     def __init__(self, screen, x, y, cell_size, map_manager):
         super().__init__(screen, x, y, cell_size, map_manager)
         self.radius = 0
         self.initialized = False  
         self.dragging = False  
 
+    def _set_radius(self, radius):
+        self.radius = radius
+
     def draw(self, x, y):
         if self.visible:
             if not self.initialized:
-                try:
-                    self.radius = int(input_box_tk("Enter radius"))
-                    self.initialized = True
-                except (TypeError, ValueError):
-                    self.initialized, self.visible = False, False
-                    return
+                self._ask_sizes(["Enter radius"], self._set_radius)
+                return
     
             self.rect.center = (x, y)
-    
-            # Загружаем картинку
-            explosion_image = pygame.image.load(self.iconic_path[3]).convert_alpha()
-    
-            # Масштабируем под нужный размер круга
-            scaled_size = (self.radius * self.cell_size * 2, self.radius * self.cell_size * 2)
-            explosion_image = pygame.transform.smoothscale(explosion_image, scaled_size)
-    
-            # Делаем белый цвет прозрачным
-            explosion_image = explosion_image.copy()
-            explosion_image.set_colorkey((255, 255, 255))  # Убираем белый
-    
-            # Устанавливаем прозрачность (альфа-канал = 120)
-            explosion_image.set_alpha(120)
+            explosion_image = self.sprite_cache.get((self.radius, self.cell_size), self._build_sprite)
     
             # Получаем координаты, чтобы центрировать картинку
             draw_x = x - self.radius * self.cell_size
             draw_y = y - self.radius * self.cell_size
     
             # Рисуем изображение
+            self.draw_highlight(x, y)
             self.screen.blit(explosion_image, (draw_x, draw_y))
 
+    def _build_sprite(self):
+        """Готовит спрайт взрыва под текущий радиус."""
+        # Загружаем картинку
+        if CircularSpell._explosion_image is None:
+            CircularSpell._explosion_image = pygame.image.load(self.iconic_path[3]).convert_alpha()
+
+        # Масштабируем под нужный размер круга
+        scaled_size = (self.radius * self.cell_size * 2, self.radius * self.cell_size * 2)
+        explosion_image = pygame.transform.smoothscale(CircularSpell._explosion_image, scaled_size)
+
+        # Делаем белый цвет прозрачным
+        explosion_image.set_colorkey((255, 255, 255))  # Убираем белый
+
+        # Устанавливаем прозрачность (альфа-канал = 120)
+        explosion_image.set_alpha(120)
+        return explosion_image
+
+    def get_bounds(self, x, y):
+        if not self.initialized:
+            return None
+        size = self.radius * self.cell_size * 2
+        bounds = pygame.Rect(0, 0, size, size)
+        bounds.center = (x, y)
+        return self._with_highlight_bounds(bounds.inflate(2, 2), x, y)
+
+    def _highlight_key(self, x, y):
+        if not self.initialized:
+            return None
+        center = self.map_manager._get_cell_indices(x, y)
+        if center is None:
+            return None
+        return center, self.radius
+
+    def _highlight_query(self, key):
+        (row, col), radius = key
+        return [tuple(cell) for cell in np.argwhere(self.map_manager.circle_mask(row, col, radius)).tolist()]
+
     def handle_event(self, event):
-        if not self.visible:
+        if not self.visible or not self.initialized:  # Пока вводятся размеры, клики не считаются
             return
 
         if event.type == pygame.MOUSEMOTION and self.dragging:
@@ -515,45 +712,14 @@ class CircularSpell(SpellWidget):
 
     def attack(self, x, y):
         """Атака по всем врагам в круге."""
-        cx, cy = x, y  
-        radius_px = self.radius * self.cell_size  
-
-        enemies_hit = []
-        
-        # Проходим по квадрату (2R + 1) x (2R + 1) вокруг центра
-        for row in range(-self.radius, self.radius + 1):
-            for col in range(-self.radius, self.radius + 1):
-                # Преобразуем смещение в координаты клеток
-                check_x = cx + col * self.cell_size
-                check_y = cy + row * self.cell_size
-                
-                # Проверяем, находится ли клетка внутри круга
-                if (check_x - cx) ** 2 + (check_y - cy) ** 2 <= radius_px ** 2:
-                    enemy = self.map_manager.get_entity(check_x, check_y)
-                    if enemy:
-                        enemies_hit.append((enemy, check_x, check_y))
+        center = self.map_manager._get_cell_indices(x, y)
+        if center is None:
+            return
+        enemies_hit = self.map_manager.query_circle(*center, self.radius)
 
         if not enemies_hit:
             return  
 
-        roll_input = input_box_tk("Enter roll")
-        if not roll_input or not roll_input.isdigit():
-            return  
-        roll = int(roll_input)
-
-        # Фильтруем, кого можно атаковать
-        successful_hits = [(enemy, x, y) for enemy, x, y in enemies_hit if roll >= enemy.armor_class]
-
-        if not successful_hits:
-            message_box("Промах!")
-            return
-
-        damage_input = input_box_tk("Enter damage")
-        if not damage_input or not damage_input.isdigit():
-            return
-        damage = int(damage_input)
-
-        for _, x, y in successful_hits:
-            self.map_manager.set_damage(x, y, damage)
+        resolve_hits(self.caster, enemies_hit, self._apply_hits)
 
 
@@ -1,7 +1,8 @@
 import json
 
 class Entity:
-    def __init__(self, name, hp, armor_class, step_size, entity_type, avatar, death_avatar):
+    def __init__(self, name, hp, armor_class, step_size, entity_type, avatar, death_avatar, initiative_modifier=0,
+                 attack_bonus=None, damage=None):
         self.name = name
         self.hp = hp
         self.armor_class = armor_class
@@ -10,6 +11,10 @@ class Entity:
         self.avatar = avatar
         self.pos = (0, 0)
         self.initiative = 0
+        self.initiative_modifier = initiative_modifier  # Бонус к броску инициативы
+        # Бонус атаки и выражение урона ("1d6+2"); если заданы, атаки монстра бросаются автоматически
+        self.attack_bonus = attack_bonus
+        self.damage = damage
         self.death_avatar = death_avatar
         self.hotkey = None
 
@@ -25,6 +30,11 @@ def load_from_json(file_path):
         entity_type = entity_data['entity_type']
         avatar = entity_data['avatar_path']
         death_avatar = entity_data['death_avatar']
-        entity = Entity(name, hp, armor_class, step_size, entity_type, avatar, death_avatar)
+        initiative_modifier = int(entity_data.get('initiative_modifier', 0))
+        attack_bonus = entity_data.get('attack_bonus')
+        attack_bonus = int(attack_bonus) if attack_bonus is not None else None
+        damage = entity_data.get('damage')
+        entity = Entity(name, hp, armor_class, step_size, entity_type, avatar, death_avatar, initiative_modifier,
+                        attack_bonus, damage)
         entities.append(entity)
     return entities
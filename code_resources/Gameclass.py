@@ -5,8 +5,12 @@ from PIL import Image
 import EntityManager
 
 class Game:
-    def __init__(self):
-        """Инициализация атрибутов игры."""
+    def __init__(self, file_path=None):
+        """
+        Инициализация атрибутов игры.
+
+        :param file_path: Путь к JSON-файлу битвы; если не задан, файл выбирается в диалоге
+        """
         self.title = ""
         self.map_path = ""
         self.players_path = ""
@@ -14,8 +18,25 @@ class Game:
         self.map_type = ""
         self.num_tiles = 0
 
-        # Вызов окна для выбора JSON-файла битвы
-        self.load_game_from_json()
+        if file_path is not None:
+            # Без окон: например, для симулятора боёв
+            self.read_battle_file(file_path)
+        else:
+            # Вызов окна для выбора JSON-файла битвы
+            self.load_game_from_json()
+
+    def read_battle_file(self, file_path):
+        """Загружает данные битвы из JSON-файла без диалогов."""
+        with open(file_path, 'r') as file:
+            data = json.load(file)
+
+        # Заполняем атрибуты экземпляра игры
+        self.title = data.get("title", "Без названия")
+        self.map_path = data.get("map_path", "")
+        self.players_path = data.get("players_path", "")
+        self.monsters_path = data.get("monsters_path", "")
+        self.num_tiles = data.get("num_tiles", 2)
+        self.map_type = data.get("map_type", "")
 
     def load_game_from_json(self):
         """Открыть окно для выбора JSON-файла битвы и загрузить данные."""
@@ -34,16 +55,7 @@ class Game:
 
         try:
             # Загружаем данные из выбранного JSON-файла
-            with open(file_path, 'r') as file:
-                data = json.load(file)
-
-            # Заполняем атрибуты экземпляра игры
-            self.title = data.get("title", "Без названия")
-            self.map_path = data.get("map_path", "")
-            self.players_path = data.get("players_path", "")
-            self.monsters_path = data.get("monsters_path", "")
-            self.num_tiles = data.get("num_tiles", 2)
-            self.map_type = data.get("map_type", "")
+            self.read_battle_file(file_path)
 
             # Выводим подтверждение
             messagebox.showinfo("Успех", f"Игра '{self.title}' успешно загружена!")
@@ -0,0 +1,239 @@
+import functools
+import re
+import numpy as np
+
+
+# Общий генератор бросков; для воспроизводимых боёв можно заменить через set_seed()
+RNG = np.random.default_rng()
+
+_TERM_RE = re.compile(r'([+-])?\s*(?:(\d*)\s*[dDкК]\s*(\d+)|(\d+))')
+
+
+def set_seed(seed):
+    """Пересоздаёт общий генератор с заданным зерном."""
+    global RNG
+    RNG = np.random.default_rng(seed)
+
+
+class DiceExpression:
+    """
+    Выражение броска вида "2d6+3", "d8", "1d10+2d6-1".
+
+    Кубы хранятся как список (количество, грани, знак), модификатор — отдельным числом.
+    """
+
+    def __init__(self, dice, modifier=0):
+        self.dice = list(dice)
+        self.modifier = modifier
+
+    @classmethod
+    def parse(cls, text):
+        """
+        Разбирает строку выражения.
+
+        :param text: Строка вида "2d6+3"; число без кубов тоже допускается
+        :return: DiceExpression
+        :raises ValueError: Если строку не удалось разобрать
+        """
+        if isinstance(text, DiceExpression):
+            return text
+        source = str(text).strip()
+        dice, modifier, position = [], 0, 0
+        while position < len(source):
+            match = _TERM_RE.match(source, position)
+            if match is None or (position and match.group(1) is None):
+                raise ValueError(f"Bad dice expression: {text!r}")
+            sign = -1 if match.group(1) == '-' else 1
+            if match.group(3) is not None:
+                count = int(match.group(2)) if match.group(2) else 1
+                sides = int(match.group(3))
+                if sides < 1:
+                    raise ValueError(f"Bad dice expression: {text!r}")
+                dice.append((count, sides, sign))
+            else:
+                modifier += sign * int(match.group(4))
+            position = match.end()
+            while position < len(source) and source[position].isspace():
+                position += 1
+        if not dice and not source:
+            raise ValueError(f"Bad dice expression: {text!r}")
+        return cls(dice, modifier)
+
+    def roll(self, n=1, crit=None, rng=None):
+        """
+        Бросает выражение n раз сразу.
+
+        :param n: Количество независимых бросков
+        :param crit: Булев массив длины n; в критических бросках кубы удваиваются
+        :param rng: Генератор NumPy (по умолчанию общий RNG)
+        :return: Массив сумм длины n
+        """
+        rng = rng or RNG
+        totals = np.full(n, self.modifier, dtype=np.int64)
+        for count, sides, sign in self.dice:
+            # Для критов бросаем вдвое больше кубов и отбрасываем лишние там, где крита нет
+            width = 2 * count if crit is not None else count
+            rolls = rng.integers(1, sides + 1, size=(n, width))
+            if crit is not None:
+                rolls[~np.asarray(crit, dtype=bool), count:] = 0
+            totals += sign * rolls.sum(axis=1)
+        return totals
+
+    def distribution(self, crit=False):
+        """
+        Точное распределение суммы.
+
+        :param crit: True — кубы удваиваются, как при крите
+        :return: (минимальное значение, массив вероятностей подряд идущих значений)
+        """
+        return _dice_distribution(tuple(self.dice), self.modifier, crit)
+
+    def __str__(self):
+        parts = [f"{'-' if sign < 0 else '+'}{count}d{sides}" for count, sides, sign in self.dice]
+        if self.modifier or not parts:
+            parts.append(f"{self.modifier:+d}")
+        return ''.join(parts).lstrip('+')
+
+
+@functools.lru_cache(maxsize=256)
+def parse_cached(text):
+    """DiceExpression.parse с запоминанием; возвращаемое выражение нельзя изменять."""
+    return DiceExpression.parse(text)
+
+
+@functools.lru_cache(maxsize=256)
+def _dice_distribution(dice, modifier, crit):
+    """Свёртка распределений отдельных кубов; результат запоминается по выражению."""
+    probabilities = np.ones(1)
+    low = modifier
+    for count, sides, sign in dice:
+        count = 2 * count if crit else count
+        die = np.full(sides, 1 / sides)
+        for _ in range(count):
+            probabilities = np.convolve(probabilities, die)
+        # Распределение куба симметрично, поэтому для вычитания достаточно сдвинуть начало
+        low += count if sign > 0 else -sides * count
+    probabilities.setflags(write=False)
+    return low, probabilities
+
+
+def d20_distribution(advantage=0):
+    """Вероятности натуральных значений 1..20 с учётом преимущества или помехи."""
+    k = np.arange(1, 21)
+    if advantage > 0:
+        return (k ** 2 - (k - 1) ** 2) / 400
+    if advantage < 0:
+        return ((21 - k) ** 2 - (20 - k) ** 2) / 400
+    return np.full(20, 1 / 20)
+
+
+class AttackAnalysis:
+    """Точные шансы и распределение урона одной атаки против одного класса брони."""
+
+    def __init__(self, hit_chance, crit_chance, damage_distribution):
+        """
+        :param hit_chance: Вероятность попадания (включая крит)
+        :param crit_chance: Вероятность крита
+        :param damage_distribution: Массив, где индекс — урон, значение — его вероятность (промах даёт 0)
+        """
+        self.hit_chance = hit_chance
+        self.crit_chance = crit_chance
+        self.damage_distribution = damage_distribution
+        self.expected_damage = float(np.dot(np.arange(len(damage_distribution)), damage_distribution))
+
+
+def _clamped_damage(low, probabilities):
+    """Распределение урона с отрицательными суммами, сведёнными к 0, индексируемое уроном."""
+    result = np.zeros(max(low + len(probabilities), 1))
+    values = np.maximum(np.arange(low, low + len(probabilities)), 0)
+    np.add.at(result, values, probabilities)
+    return result
+
+
+@functools.lru_cache(maxsize=4096)
+def analyze_attack(attack_bonus, damage, armor_class, advantage=0, crit_range=20):
+    """
+    Считает точные шансы попадания и распределение урона атаки, по тем же правилам, что resolve_attacks.
+
+    :param attack_bonus: Бонус атаки
+    :param damage: Выражение урона (строка)
+    :param armor_class: Класс брони цели
+    :return: AttackAnalysis (запоминается по всем аргументам)
+    """
+    natural = np.arange(1, 21)
+    natural_probabilities = d20_distribution(advantage)
+    crit = natural >= crit_range
+    hit = crit | ((natural != 1) & (natural + attack_bonus >= armor_class))
+    crit_chance = float(natural_probabilities[crit].sum())
+    hit_chance = float(natural_probabilities[hit].sum())
+
+    expression = parse_cached(damage)
+    normal = _clamped_damage(*expression.distribution())
+    critical = _clamped_damage(*expression.distribution(crit=True))
+    distribution = np.zeros(max(len(normal), len(critical)))
+    distribution[0] = 1 - hit_chance
+    distribution[:len(normal)] += (hit_chance - crit_chance) * normal
+    distribution[:len(critical)] += crit_chance * critical
+    distribution.setflags(write=False)
+    return AttackAnalysis(hit_chance, crit_chance, distribution)
+
+
+def has_attack_stats(entity):
+    """True, если у сущности заданы бонус атаки и урон."""
+    return entity is not None and getattr(entity, 'attack_bonus', None) is not None \
+        and getattr(entity, 'damage', None) is not None
+
+
+def analyze_targets(entity, targets):
+    """
+    Анализ атаки сущности по каждой цели.
+
+    :param entity: Атакующий с attack_bonus и damage
+    :param targets: Сущности-цели
+    :return: Список AttackAnalysis в порядке целей; пустой, если у атакующего нет характеристик атаки
+    """
+    if not has_attack_stats(entity):
+        return []
+    damage = str(entity.damage)
+    return [analyze_attack(int(entity.attack_bonus), damage, int(target.armor_class)) for target in targets]
+
+
+def roll_d20(n=1, advantage=0, rng=None):
+    """
+    Бросает n d20.
+
+    :param advantage: > 0 — преимущество (лучший из двух), < 0 — помеха (худший из двух)
+    :return: Массив натуральных значений d20
+    """
+    rng = rng or RNG
+    if not advantage:
+        return rng.integers(1, 21, size=n)
+    pairs = rng.integers(1, 21, size=(n, 2))
+    return pairs.max(axis=1) if advantage > 0 else pairs.min(axis=1)
+
+
+def resolve_attacks(attack_bonus, damage, armor_classes, advantage=0, crit_range=20, rng=None):
+    """
+    Бросает пачку атак разом: по одной атаке на каждый класс брони в armor_classes.
+
+    Натуральная 1 — всегда промах, натуральное значение не меньше crit_range — крит и попадание.
+
+    :param attack_bonus: Бонус атаки (число или массив той же длины, что armor_classes)
+    :param damage: Выражение урона (строка или DiceExpression)
+    :param armor_classes: Классы брони целей
+    :return: Словарь массивов: natural, total, hit, crit, damage (0 для промахов)
+    """
+    armor_classes = np.asarray(armor_classes, dtype=np.int64)
+    n = len(armor_classes)
+    natural = roll_d20(n, advantage, rng)
+    total = natural + np.asarray(attack_bonus, dtype=np.int64)
+    crit = natural >= crit_range
+    hit = crit | ((natural != 1) & (total >= armor_classes))
+    damage_rolls = np.maximum(DiceExpression.parse(damage).roll(n, crit=crit, rng=rng), 0)
+    return {"natural": natural, "total": total, "hit": hit, "crit": crit,
+            "damage": np.where(hit, damage_rolls, 0)}
+
+
+def can_auto_attack(entity):
+    """True, если у сущности заданы бонус атаки и урон и её атаки можно бросать автоматически."""
+    return has_attack_stats(entity) and entity.entity_type == 'Monster'
@@ -0,0 +1,107 @@
+import pygame
+
+# События мыши, которые доставляются по положению курсора
+POINTER_EVENTS = (pygame.MOUSEMOTION, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP)
+
+
+class SpatialIndex:
+    """
+    Равномерная сетка корзин для поиска прямоугольников под точкой.
+
+    Каждому ключу соответствует набор прямоугольников; ключ попадает во все
+    корзины, которые задевают его прямоугольники.
+    """
+
+    def __init__(self, bucket_size=128):
+        self.bucket_size = bucket_size
+        self._buckets = {}  # (bx, by) -> {ключ: None}
+        self._rects = {}  # ключ -> кортеж Rect
+
+    def _bucket_range(self, rect):
+        size = self.bucket_size
+        return (range(rect.left // size, (rect.right - 1) // size + 1),
+                range(rect.top // size, (rect.bottom - 1) // size + 1))
+
+    def update(self, key, rects):
+        """Заменяет прямоугольники ключа; если они не изменились, ничего не делает."""
+        rects = tuple(pygame.Rect(rect) for rect in rects if rect is not None)
+        rects = tuple(rect for rect in rects if rect.width > 0 and rect.height > 0)
+        if self._rects.get(key) == rects:
+            return
+        self.remove(key)
+        self._rects[key] = rects
+        for rect in rects:
+            columns, rows = self._bucket_range(rect)
+            for bx in columns:
+                for by in rows:
+                    self._buckets.setdefault((bx, by), {})[key] = None
+
+    def remove(self, key):
+        for rect in self._rects.pop(key, ()):
+            columns, rows = self._bucket_range(rect)
+            for bx in columns:
+                for by in rows:
+                    bucket = self._buckets.get((bx, by))
+                    if bucket is not None:
+                        bucket.pop(key, None)
+                        if not bucket:
+                            del self._buckets[(bx, by)]
+
+    def query_point(self, pos):
+        """Ключи, у которых хотя бы один прямоугольник содержит точку."""
+        x, y = pos
+        bucket = self._buckets.get((x // self.bucket_size, y // self.bucket_size), ())
+        return [key for key in bucket if any(rect.collidepoint(x, y) for rect in self._rects[key])]
+
+
+class EventRouter:
+    """
+    Раздаёт события обработчикам.
+
+    События мыши получают только обработчики под курсором или те, кто сейчас
+    захватил мышь (перетаскивание, прицеливание заклинанием). Остальные события
+    (клавиатура и т.п.) получают все. Порядок доставки — порядок регистрации.
+    """
+
+    def __init__(self, bucket_size=128):
+        self.index = SpatialIndex(bucket_size)
+        self._handlers = []  # (обработчик, hit_rects, captures)
+        self._captors = []
+        self._stale = True
+
+    def register(self, handler, hit_rects, captures=None):
+        """
+        :param handler: Объект с методом handle_event(event)
+        :param hit_rects: Функция без аргументов, возвращающая прямоугольники, по которым обработчик ловит клики
+        :param captures: Функция без аргументов; True — обработчик получает все события мыши
+        """
+        self._handlers.append((handler, hit_rects, captures))
+        self._stale = True
+
+    def refresh(self):
+        """Обновляет индекс прямоугольников и список захвативших мышь."""
+        for order, (_, hit_rects, _) in enumerate(self._handlers):
+            self.index.update(order, hit_rects())
+        self._captors = [order for order, (_, _, captures) in enumerate(self._handlers) if captures and captures()]
+        self._stale = False
+
+    def dispatch(self, event):
+        if self._stale:
+            self.refresh()
+        if event.type in POINTER_EVENTS:
+            captured = bool(self._captors)
+            targets = self._captors or sorted(self.index.query_point(event.pos))
+            for order in targets:
+                self._handlers[order][0].handle_event(event)
+            if not captured and event.type == pygame.MOUSEBUTTONDOWN:
+                # Клик мог запустить прицеливание (кнопка тулбара) — тот же клик получает и новый захватчик
+                self.refresh()
+                for order in self._captors:
+                    if order not in targets:
+                        self._handlers[order][0].handle_event(event)
+        else:
+            for handler, _, _ in self._handlers:
+                handler.handle_event(event)
+        if event.type != pygame.MOUSEMOTION:
+            # Клики и клавиши могут открыть тулбар, начать перетаскивание или показать заклинание
+            self._stale = True
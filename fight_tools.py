@@ -3,62 +3,11 @@ from PIL import Image, ImageDraw
 import math
 import maptools
 import sys
-import tkinter as tk
-from tkinter import filedialog, messagebox
-from tkinter.simpledialog import askstring
-from SpellWidgets import BowSpell, LinearSpell, CircularSpell, TriangleSpell
+from SpellWidgets import BowSpell, LinearSpell, CircularSpell, TriangleSpell, resolve_hits
+import render_tools
+import dice
 
 
-def input_box_tk(prompt):
-    root = tk.Tk()
-    root.geometry("0x0")  # Делаем окно невидимым
-    root.overrideredirect(1)  # Убираем заголовок окна
-    """
-    Окно ввода с использованием tkinter.
-    Возвращает введенное значение.
-    """
-    root.withdraw()  # Скрыть основное окно tkinter
-    root.attributes("-topmost", True)  # Поверх всех окон
-    result = askstring("Input", prompt)
-    root.attributes("-topmost", False)  # Снять приоритет
-    root.deiconify()  # Вернуть окно tkinter
-    root.destroy()
-    return result
-
-def message_box(message):
-    root = tk.Tk()
-    root.withdraw()
-    def close_window(event=None):
-        custom_window.destroy()
-    title = ''
-    custom_window = tk.Toplevel()
-    custom_window.title(title)
-    custom_window.geometry("100x70")
-    custom_window.resizable(False, False)
-
-    # Центрируем окно на экране
-    custom_window.update_idletasks()
-    width = custom_window.winfo_width()
-    height = custom_window.winfo_height()
-    x = (custom_window.winfo_screenwidth() // 2) - (width // 2)
-    y = (custom_window.winfo_screenheight() // 2) - (height // 2)
-    custom_window.geometry(f"{width}x{height}+{x}+{y}")
-
-    # Сообщение
-    label = tk.Label(custom_window, text=message, padx=10, pady=10)
-    label.pack()
-    button = tk.Button(custom_window, text="OK", command=close_window)
-    button.pack()
-    custom_window.bind("<Return>", close_window)
-    custom_window.focus_force()
-    custom_window.transient()  # Устанавливаем как модальное окно
-    custom_window.grab_set()  # Захватываем фокус
-    # Ожидание действия пользователя
-    custom_window.transient()  # Устанавливаем как модальное окно
-    custom_window.grab_set()  # Захватываем фокус
-    custom_window.wait_window(custom_window)
-    root.destroy()
-    
 class Button:
     def __init__(self, button_name, entity, callback, x, y, size, icon_path):
         self.button_name = button_name
@@ -69,7 +18,8 @@ class Button:
         self.size = size
         self.rect = pygame.Rect(x, y, size, size)  # Прямоугольник кнопки
         padding = 10
-        self.icon = pygame.transform.smoothscale(pygame.image.load(icon_path), (size - padding, size - padding))
+        # Иконка берётся из общего атласа, уже уменьшенная под размер кнопки
+        self.icon = render_tools.get_icon_atlas().get(icon_path, size - padding)
         self.is_pressed = False
 
     def draw_button(self, surface):
@@ -120,6 +70,161 @@ class SubToolbar:
                     button.on_click()
 
 
+class ToolAction:
+    """
+    Действие тулбара, ожидающее клика по полю (шаг, удар мечом).
+
+    Действием управляет главный цикл через TOOLS: оно получает события,
+    рисуется каждый кадр и завершается кликом или отменяется по Esc.
+    """
+
+    def __init__(self, toolbar, reach):
+        """
+        :param toolbar: Тулбар, из которого запущено действие
+        :param reach: Радиус области действия в клетках вокруг виджета
+        """
+        self.toolbar = toolbar
+        self.widget = toolbar.widget
+        self.entity = toolbar.entity
+        self.finished = False
+        # Центровка квадрата досягаемости по виджету
+        cell_size = toolbar.cell_size
+        rect_len = (2 * reach + 1) * cell_size
+        self.area = pygame.Rect(0, 0, rect_len, rect_len)
+        self.area.topleft = (self.widget.x + cell_size // 2 - rect_len // 2,
+                             self.widget.y + cell_size // 2 - rect_len // 2)
+
+    def handle_event(self, event):
+        """
+        :return: True, если событие поглощено действием
+        """
+        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
+            mx, my = event.pos
+            if self.area.collidepoint(mx, my):
+                self.on_click(mx, my)
+            self.finished = True  # Клик мимо области завершает действие, как и раньше
+            return True
+        return False
+
+    def on_click(self, mx, my):
+        ...
+
+    def cancel(self):
+        self.finished = True
+
+    def get_bounds(self):
+        return self.area
+
+    def draw(self, surface):
+        ...
+
+
+class MoveStepsAction(ToolAction):
+    """Перемещение сущности в пределах её шага."""
+
+    def __init__(self, toolbar):
+        super().__init__(toolbar, int(toolbar.entity.step_size))
+        self.step_surface = pygame.Surface(self.area.size, pygame.SRCALPHA)
+        self.step_surface.fill((152, 251, 152, 20))  # Цвет с альфа-каналом
+
+    def on_click(self, mx, my):
+        map_manager = self.widget.map_manager
+        enemy = map_manager.get_entity(mx, my)
+        cell = map_manager._get_cell_indices(mx, my)
+        print(f'Step detected enemy at {cell}: {enemy}')
+        if enemy is not None or cell is None:
+            return
+        map_manager.remove_entity_by_value(self.entity)
+        self.widget.snap_to_cell(mx, my)
+        self.widget.update_toolbar_position()
+
+    def draw(self, surface):
+        surface.blit(self.step_surface, self.area.topleft)
+
+
+class MeleeAttackAction(ToolAction):
+    """Рукопашная атака по соседней клетке."""
+
+    def __init__(self, toolbar):
+        super().__init__(toolbar, 1)
+
+    def on_click(self, mx, my):
+        map_manager = self.widget.map_manager
+        enemy = map_manager.get_entity(mx, my)
+        cell = map_manager._get_cell_indices(mx, my)
+        print(f'Sword detected enemy at {cell}: {enemy}')
+        if enemy is None or enemy is self.entity or cell is None:
+            return  # Себя не атакуем — как и в подписях шансов
+        row, col = cell
+        # Монстр с заданной атакой бросает сам, иначе бросок и урон вводятся вручную
+        resolve_hits(self.entity, [(enemy, row, col)], lambda hits: map_manager.set_damage_cells(
+            (row, col, damage) for _, row, col, damage in hits))
+
+    def draw(self, surface):
+        # Граница предела досягаемости рукопашной атаки
+        pygame.draw.rect(surface, (130, 0, 0), self.area, 2)
+        self.draw_melee_odds(surface)
+
+    def draw_melee_odds(self, surface):
+        """Подписывает на соседних целях шанс попадания и средний урон рукопашной атаки."""
+        map_manager = self.widget.map_manager
+        cell = map_manager.get_entity_cell(self.entity)
+        if cell is None:
+            return
+        row, col = cell
+        targets = [(enemy, r, c) for enemy, r, c in map_manager.query_rect(row - 1, col - 1, row + 1, col + 1)
+                   if enemy is not self.entity]
+        analyses = dice.analyze_targets(self.entity, [enemy for enemy, _, _ in targets])
+        for (_, r, c), analysis in zip(targets, analyses):
+            label = render_tools.render_text(f"{analysis.hit_chance:.0%} ~{analysis.expected_damage:.1f}",
+                                             max(14, self.toolbar.cell_size * 0.3), (255, 255, 255))
+            cell_rect = map_manager.cell_rect(r, c)
+            surface.blit(label, label.get_rect(midtop=(cell_rect.centerx, cell_rect.top + 3)))
+
+
+class ToolController:
+    """Держит не больше одного активного действия тулбара и передаёт ему события главного цикла."""
+
+    def __init__(self):
+        self.active = None
+
+    def start(self, action):
+        """Запускает действие, отменяя предыдущее."""
+        if self.active is not None:
+            self.active.cancel()
+        self.active = action
+
+    def handle_event(self, event):
+        """
+        :return: True, если событие поглощено активным действием
+        """
+        action = self.active
+        if action is None:
+            return False
+        if event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+            action.cancel()
+            consumed = True
+        else:
+            consumed = action.handle_event(event)
+        if action.finished and self.active is action:
+            self.active = None
+        return consumed
+
+    def get_bounds(self):
+        return self.active.get_bounds() if self.active is not None else None
+
+    def get_render_state(self):
+        return id(self.active) if self.active is not None else None
+
+    def draw(self, surface):
+        if self.active is not None:
+            self.active.draw(surface)
+
+
+# Единственное активное действие тулбара; главный цикл передаёт ему события и рисует его
+TOOLS = ToolController()
+
+
 class Toolbar:
     def __init__(self, widget, entity, x, y, cell_size, spell_widgets):
         self.entity = entity
@@ -155,103 +260,14 @@ class Toolbar:
 
     
     def move_steps(self, entity):
-        cell_size = self.cell_size
-        num_steps = int(self.entity.step_size)
-        rect_len = (2 * num_steps + 1) * cell_size
-
-    # Центровка квадрата
-        widget_center_x = self.widget.x + cell_size // 2
-        widget_center_y = self.widget.y + cell_size // 2
-        top_left_x = widget_center_x - rect_len // 2
-        top_left_y = widget_center_y - rect_len // 2
-        step_surface = pygame.Surface((rect_len, rect_len), pygame.SRCALPHA)
-        step_surface.fill((152, 251, 152, 20))  # Цвет с альфа-каналом
-        # Рисуем поверхность на экране
-        cur_rect = self.widget.screen.blit(step_surface, (top_left_x, top_left_y))
-        pygame.display.flip()
-        # Ожидание клика
-        waiting = True
-        while waiting:
-            for event in pygame.event.get():
-                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                    click_pos = pygame.mouse.get_pos()
-                    mx, my = click_pos
-                    if not cur_rect.collidepoint(mx, my):
-                        return
-                    enemy = self.widget.map_manager.get_entity(mx, my)
-                    row, col = self.widget.map_manager._get_cell_indices(mx, my)
-                    print(f'Step detected enemy at {row}, {col}: {enemy}')
-                    if enemy is not None:
-                        return
-                    self.widget.map_manager.remove_entity(mx, my)
-                    self.widget.map_manager.remove_entity_by_value(self.entity)
-                    self.widget.snap_to_cell(mx, my)
-                    self.widget.update_toolbar_position()
-                    waiting = False
-                elif event.type == pygame.QUIT:
-                    pygame.quit()
-                    exit()
-
+        TOOLS.start(MoveStepsAction(self))
 
     def attack_sword(self, entity):
-        # Отрисовываем предел досягаемости рукопашной атаки
-        cell_size = self.cell_size
-        num_steps = 1
-        rect_len = (2 * num_steps + 1) * cell_size
-        widget_center_x = self.widget.x + cell_size // 2
-        widget_center_y = self.widget.y + cell_size // 2
-        top_left_x = widget_center_x - rect_len // 2
-        top_left_y = widget_center_y - rect_len // 2
-        # Создаем полупрозрачную поверхность
-        step_surface = pygame.Surface((rect_len, rect_len), pygame.SRCALPHA)
-        # Рисуем только границу
-        border_color = (130, 0, 0, 255)  # Цвет границы (RGBA)
-        border_width = 2  # Толщина границы
-        cur_rect = pygame.draw.rect(step_surface, border_color, (0, 0, rect_len, rect_len), border_width)
-        hitbox_rect = pygame.Rect(top_left_x, top_left_y, rect_len, rect_len)
-        # Рисуем поверхность на экране
-        self.widget.screen.blit(step_surface, (top_left_x, top_left_y))
-        pygame.display.flip()
-        #Ожидание клика
-        waiting = True
-        while waiting:
-            for event in pygame.event.get():
-                if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-                    click_pos = pygame.mouse.get_pos()
-                    mx, my = click_pos
-                    if not hitbox_rect.collidepoint(mx, my):
-                        return
-                    entity = self.widget.map_manager.get_entity(mx, my)
-                    enemy = self.widget.map_manager.get_entity(mx, my)
-                    row, col = self.widget.map_manager._get_cell_indices(mx, my)
-                    print(f'Sword detected enemy at {row}, {col}: {enemy}')
-                    if entity:
-                        armor_class = entity.armor_class
-                        roll_input = input_box_tk("Enter roll")
-                        if roll_input and roll_input.isdigit():
-                            roll = int(roll_input)
-                            if roll >= armor_class:
-                                message_box('Попадание!')
-                                # Ввод урона
-                                damage_input = input_box_tk("Enter damage")
-                                if damage_input and damage_input.isdigit():
-                                    damage = int(damage_input)
-                                    self.widget.map_manager.set_damage(mx, my, damage)
-                                else:
-                                    print("Invalid damage input.")
-                            else:
-                                message_box('Промах')
-                        else:
-                            print("Invalid roll input.")
-                    waiting = False
-                    
-                elif event.type == pygame.QUIT:
-                    pygame.quit()
-                    exit()
-                    
+        TOOLS.start(MeleeAttackAction(self))
 
     def attack_bow(self, entity):
         attack_widget = self.spell_widgets[0]
+        attack_widget.caster = self.entity
         attack_widget.visible = True
         mx, my = pygame.mouse.get_pos()
         attack_widget.draw(mx, my)
@@ -271,6 +287,7 @@ class Toolbar:
     def cast_line(self, entity):
         center_x, center_y = self.widget.x + self.widget.diameter / 2, self.widget.y + self.widget.diameter / 2
         attack_widget = self.spell_widgets[1]
+        attack_widget.caster = self.entity
         attack_widget.visible = True
         attack_widget.x = center_x
         attack_widget.y = center_y
@@ -279,6 +296,7 @@ class Toolbar:
     def cast_cone(self, entity):
         center_x, center_y = self.widget.x + self.widget.diameter / 2, self.widget.y + self.widget.diameter / 2
         attack_widget = self.spell_widgets[3]
+        attack_widget.caster = self.entity
         attack_widget.x = center_x
         attack_widget.y = center_y
         attack_widget.visible = True
@@ -286,6 +304,7 @@ class Toolbar:
 
     def cast_radius(self, entity):
         attack_widget = self.spell_widgets[2]
+        attack_widget.caster = self.entity
         attack_widget.visible = True
         mx, my = pygame.mouse.get_pos()
         attack_widget.draw(mx, my)
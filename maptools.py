@@ -1,4 +1,10 @@
+import bisect
+import functools
+import heapq
+import math
+from collections import OrderedDict
 import pygame
+import numpy as np
 from PIL import Image
 import tkinter as tk
 from tkinter import filedialog, messagebox
@@ -84,6 +90,249 @@ def create_grid(rows, cols, cell_width, cell_height, start_x=0, start_y=0, total
     return grid
 
 
+class GridOverlay:
+    """
+    Заранее отрисованный слой сетки: заливка и границы всех клеток в одной поверхности.
+    Подсвеченная клетка рисуется отдельным маленьким блитом поверх слоя.
+    """
+
+    def __init__(self, grid, border_color=(255, 255, 255), fill_color=(0, 0, 0, 50),
+                 hover_color=(255, 255, 255, 80), border_width=1):
+        self.border_color = border_color
+        self.fill_color = fill_color
+        self.hover_color = hover_color
+        self.border_width = border_width
+        self.geometry = None
+        self.layer = None
+        self.origin = (0, 0)
+        self.hover_surface = None
+        self.update(grid)
+
+    @staticmethod
+    def _grid_geometry(grid):
+        """Ключ геометрии сетки: меняется только при перестроении create_grid."""
+        return tuple(tuple(tuple(cell.rect) for cell in row) for row in grid)
+
+    def update(self, grid):
+        """
+        Перестраивает слой, если геометрия сетки изменилась (например, после ресайза).
+
+        :return: True, если слой был перестроен
+        """
+        geometry = self._grid_geometry(grid)
+        if geometry == self.geometry:
+            return False
+        self.geometry = geometry
+        self.grid = grid
+        self.layer = None
+        self.hover_surface = None
+        if not grid or not grid[0]:
+            return True
+
+        bounds = grid[0][0].rect.unionall([cell.rect for row in grid for cell in row])
+        self.origin = bounds.topleft
+        self.layer = pygame.Surface(bounds.size, pygame.SRCALPHA)
+        for row in grid:
+            for cell in row:
+                local_rect = cell.rect.move(-bounds.x, -bounds.y)
+                self.layer.fill(self.fill_color, local_rect)
+                pygame.draw.rect(self.layer, self.border_color, local_rect, self.border_width)
+
+        # Границы столбцов и строк для поиска клетки под курсором без перебора
+        self._col_edges = [cell.rect.x for cell in grid[0]]
+        self._row_edges = [row[0].rect.y for row in grid]
+        return True
+
+    def cell_at(self, pos):
+        """Возвращает клетку под точкой pos или None."""
+        if self.layer is None:
+            return None
+        x, y = pos
+        col = bisect.bisect_right(self._col_edges, x) - 1
+        row = bisect.bisect_right(self._row_edges, y) - 1
+        if row < 0 or col < 0:
+            return None
+        cell = self.grid[row][col]
+        return cell if cell.rect.collidepoint(pos) else None
+
+    def draw(self, surface, mouse_pos=None):
+        if self.layer is None:
+            return
+        surface.blit(self.layer, self.origin)
+
+        cell = self.cell_at(mouse_pos) if mouse_pos is not None else None
+        if cell is None:
+            return
+        if self.hover_surface is None or self.hover_surface.get_size() != cell.rect.size:
+            self.hover_surface = pygame.Surface(cell.rect.size, pygame.SRCALPHA)
+            self.hover_surface.fill(self.hover_color)
+            pygame.draw.rect(self.hover_surface, self.border_color, self.hover_surface.get_rect(), self.border_width)
+        surface.blit(self.hover_surface, cell.rect.topleft)
+
+
+# Допуск для клеток, центр которых лежит ровно на границе фигуры
+SHAPE_EPSILON = 1e-9
+
+
+def _offset_grid(reach):
+    """Смещения клеток (d_row, d_col) в квадрате со стороной 2 * reach + 1 вокруг начала."""
+    return np.ogrid[-reach:reach + 1, -reach:reach + 1]
+
+
+def rasterize_circle(radius):
+    """
+    Трафарет круга: клетка задета, если её центр не дальше radius клеток от центра исходной клетки.
+
+    :param radius: Радиус в клетках
+    :return: (stencil, reach) — булев массив (2 * reach + 1)^2 с исходной клеткой в центре
+    """
+    reach = int(math.ceil(radius))
+    d_row, d_col = _offset_grid(reach)
+    return d_row ** 2 + d_col ** 2 <= radius ** 2 + SHAPE_EPSILON, reach
+
+
+@functools.lru_cache(maxsize=1024)
+def supercover_line(length, angle):
+    """
+    Клетки, которые пересекает отрезок из центра исходной клетки длиной length клеток
+    (обход сетки DDA, вариант supercover). Если отрезок проходит ровно через угол клеток,
+    задеваются обе соседние клетки. Время работы линейно по длине.
+
+    :param length: Длина в клетках
+    :param angle: Направление в радианах (как atan2(dy, dx) на экране)
+    :return: Кортеж смещений (d_row, d_col) в порядке следования вдоль линии, без исходной клетки
+    """
+    dx, dy = math.cos(angle), math.sin(angle)
+    step_col = 1 if dx > 0 else -1
+    step_row = 1 if dy > 0 else -1
+    # Параметр t (расстояние вдоль линии) до ближайшей вертикальной и горизонтальной границы
+    t_delta_col = 1 / abs(dx) if abs(dx) > SHAPE_EPSILON else math.inf
+    t_delta_row = 1 / abs(dy) if abs(dy) > SHAPE_EPSILON else math.inf
+    t_col, t_row = t_delta_col / 2, t_delta_row / 2
+
+    row = col = 0
+    cells = []
+    limit = length - SHAPE_EPSILON  # Касание границы в самом конце клетку не задевает
+    while min(t_col, t_row) < limit:
+        if abs(t_col - t_row) <= SHAPE_EPSILON:
+            # Проход через угол: задеваем обе соседние клетки, затем диагональную
+            cells.append((row, col + step_col))
+            cells.append((row + step_row, col))
+            row, col = row + step_row, col + step_col
+            t_col += t_delta_col
+            t_row += t_delta_row
+        elif t_col < t_row:
+            col += step_col
+            t_col += t_delta_col
+        else:
+            row += step_row
+            t_row += t_delta_row
+        cells.append((row, col))
+    return tuple(cells)
+
+
+def rasterize_line(length, angle):
+    """
+    Трафарет линии: все клетки, которые пересекает отрезок (см. supercover_line).
+    Исходная клетка (маг) не задевается.
+
+    :param length: Длина в клетках
+    :param angle: Направление в радианах
+    """
+    reach = int(math.ceil(length)) + 1
+    stencil = np.zeros((2 * reach + 1, 2 * reach + 1), dtype=bool)
+    cells = supercover_line(length, angle)
+    if cells:
+        d_rows, d_cols = zip(*cells)
+        stencil[np.array(d_rows) + reach, np.array(d_cols) + reach] = True
+    return stencil, reach
+
+
+def rasterize_cone(height, base, angle):
+    """
+    Трафарет конуса с вершиной в центре исходной клетки: клетка задета, если её центр
+    лежит внутри треугольника высоты height и основания base (в клетках). Исходная клетка не задевается.
+
+    :param angle: Направление оси конуса в радианах
+    """
+    reach = int(math.ceil(math.hypot(height, base / 2)))
+    d_row, d_col = _offset_grid(reach)
+    along = d_col * math.cos(angle) + d_row * math.sin(angle)
+    across = np.abs(d_row * math.cos(angle) - d_col * math.sin(angle))
+    half_base = base / 2
+    stencil = ((along > SHAPE_EPSILON) & (along <= height + SHAPE_EPSILON)
+               & (across * height <= half_base * along + SHAPE_EPSILON))
+    return stencil, reach
+
+
+class StencilLibrary:
+    """
+    LRU-кэш скомпилированных трафаретов областей поражения.
+
+    Ключ — (фигура, размеры, корзина угла). Трафарет строится один раз,
+    а наложение на поле (MapManager.stamp) стоит одного среза массива.
+    """
+
+    # Построители трафаретов: направление (если есть) идёт первым аргументом
+    RASTERIZERS = {
+        "circle": lambda radius: rasterize_circle(radius),
+        "line": lambda angle, length: rasterize_line(length, angle),
+        "cone": lambda angle, height, base: rasterize_cone(height, base, angle),
+    }
+
+    def __init__(self, max_size=512, angle_step=1):
+        """
+        :param max_size: Сколько трафаретов держать в памяти
+        :param angle_step: Шаг квантования направления, градусы
+        """
+        self.max_size = max_size
+        self.angle_step = angle_step
+        self._stencils = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def quantize_angle(self, angle):
+        """Номер корзины угла для направления angle (радианы)."""
+        buckets = round(360 / self.angle_step)
+        return round(math.degrees(angle) / self.angle_step) % buckets
+
+    def get(self, shape, *sizes, angle=None):
+        """
+        Возвращает трафарет (stencil, reach) для фигуры.
+
+        :param shape: "circle", "line" или "cone"
+        :param sizes: Размеры фигуры в клетках, как у rasterize_*
+        :param angle: Направление в радианах (для линии и конуса)
+        """
+        bucket = None if angle is None else self.quantize_angle(angle)
+        key = (shape, sizes, bucket)
+        stencil = self._stencils.get(key)
+        if stencil is not None:
+            self._stencils.move_to_end(key)
+            self.hits += 1
+            return stencil
+
+        self.misses += 1
+        rasterize = self.RASTERIZERS[shape]
+        if bucket is None:
+            stencil, reach = rasterize(*sizes)
+        else:
+            stencil, reach = rasterize(math.radians(bucket * self.angle_step), *sizes)
+        stencil.flags.writeable = False  # Трафарет общий, менять его нельзя
+        self._stencils[key] = (stencil, reach)
+        if len(self._stencils) > self.max_size:
+            self._stencils.popitem(last=False)
+        return stencil, reach
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {"size": len(self._stencils), "max_size": self.max_size, "hits": self.hits,
+                "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+
+# Общая библиотека трафаретов для всех карт
+STENCILS = StencilLibrary()
+
 
 class MapManager:
     def __init__(self, grid):
@@ -92,13 +341,21 @@ class MapManager:
 
         :param grid: Сетка (двумерный список объектов GridCell)
         """
-        # Создаем таблицу для объектов
+        # Создаем таблицу для объектов: в клетке хранится ID сущности, 0 — пусто
         self.rows = len(grid)
         self.cols = len(grid[0]) if self.rows > 0 else 0
-        self.table = [[None for _ in range(self.cols)] for _ in range(self.rows)]
+        self.occupancy = np.zeros((self.rows, self.cols), dtype=np.int32)
+        self._entity_ids = {}
+        self._entities_by_id = [None]
+
+        # Обратные индексы к таблице: сущность -> клетка и имя -> сущности на поле
+        self.entity_cells = {}
+        self._entities_by_name = {}
+        # Подписчики на появление/уход сущностей с поля: callback(entity, on_board)
+        self._listeners = []
 
         # Создаем таблицу для урона
-        self.damage_table = [[0 for _ in range(self.cols)] for _ in range(self.rows)]
+        self.damage_table = np.zeros((self.rows, self.cols), dtype=np.int64)
 
         # Сохраняем границы ячеек для перевода координат
         self.cell_width = grid[0][0].rect.width if self.rows > 0 and self.cols > 0 else 0
@@ -121,6 +378,67 @@ class MapManager:
             return row, col
         return None
 
+    def cell_rect(self, row, col):
+        """Прямоугольник клетки (row, col) в экранных координатах."""
+        return pygame.Rect(self.start_x + col * self.cell_width, self.start_y + row * self.cell_height,
+                           self.cell_width, self.cell_height)
+
+    def add_listener(self, callback):
+        """
+        Подписывает callback(entity, on_board) на появление сущности на поле и уход с него.
+        Перемещение между клетками не сообщается.
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, entity, on_board):
+        for callback in self._listeners:
+            callback(entity, on_board)
+
+    def _place(self, row, col, entity):
+        """Кладёт сущность в клетку, поддерживая индексы. Старая клетка сущности очищается."""
+        previous_cell = self.entity_cells.get(entity)
+        if previous_cell == (row, col):
+            return
+        if previous_cell is not None:
+            self._clear_cell(*previous_cell, notify=False)
+        self._clear_cell(row, col)  # Вытесняем того, кто стоял в клетке
+        entity_id = self._entity_ids.get(entity)
+        if entity_id is None:
+            entity_id = len(self._entities_by_id)
+            self._entity_ids[entity] = entity_id
+            self._entities_by_id.append(entity)
+        self.occupancy[row, col] = entity_id
+        self.entity_cells[entity] = (row, col)
+        self._entities_by_name.setdefault(getattr(entity, 'name', ''), {})[entity] = None
+        if previous_cell is None:
+            self._notify(entity, True)
+
+    def _clear_cell(self, row, col, notify=True):
+        """Очищает клетку и убирает её сущность из индексов."""
+        entity = self._entities_by_id[self.occupancy[row, col]]
+        if entity is None:
+            return
+        self.occupancy[row, col] = 0
+        if self.entity_cells.get(entity) == (row, col):
+            del self.entity_cells[entity]
+            name = getattr(entity, 'name', '')
+            namesakes = self._entities_by_name.get(name)
+            if namesakes is not None:
+                namesakes.pop(entity, None)
+                if not namesakes:
+                    del self._entities_by_name[name]
+            if notify:
+                self._notify(entity, False)
+
+    def get_entity_cell(self, entity):
+        """
+        Возвращает клетку, в которой стоит сущность.
+
+        :param entity: Объект сущности
+        :return: Кортеж (row, col) или None, если сущности нет на поле
+        """
+        return self.entity_cells.get(entity)
+
     def is_empty(self, x, y):
         """
         Проверяет, пустая ли ячейка по заданным координатам.
@@ -132,7 +450,7 @@ class MapManager:
         indices = self._get_cell_indices(x, y)
         if indices:
             row, col = indices
-            return self.table[row][col] is None
+            return self.occupancy[row, col] == 0
         return False
 
     def set_entity(self, x, y, entity):
@@ -147,11 +465,7 @@ class MapManager:
         indices = self._get_cell_indices(x, y)
         if indices:
             row, col = indices
-            for r in range(len(self.table)):
-                for c in range(len(self.table[r])):
-                    if self.table[r][c] == entity and (r != row or c != col):
-                        self.table[r][c] = None  # Очистка клетки
-            self.table[row][col] = entity
+            self._place(row, col, entity)
             return True
         return False
 
@@ -166,7 +480,7 @@ class MapManager:
         indices = self._get_cell_indices(x, y)
         if indices:
             row, col = indices
-            self.table[row][col] = None
+            self._clear_cell(row, col)
             return True
         return False
 
@@ -181,7 +495,7 @@ class MapManager:
         indices = self._get_cell_indices(x, y)
         if indices:
             row, col = indices
-            return self.table[row][col]
+            return self._entities_by_id[self.occupancy[row, col]]
         return None
 
     def remove_entity_by_value(self, entity):
@@ -190,10 +504,9 @@ class MapManager:
 
         :param entity: Объект, который нужно удалить
         """
-        for row in range(self.rows):
-            for col in range(self.cols):
-                if self.table[row][col] == entity:
-                    self.table[row][col] = None
+        cell = self.entity_cells.get(entity)
+        if cell is not None:
+            self._clear_cell(*cell)
 
     def set_damage(self, x, y, damage):
         """
@@ -207,32 +520,163 @@ class MapManager:
         indices = self._get_cell_indices(x, y)
         if indices:
             row, col = indices
-            self.damage_table[row][col] = damage
+            self.damage_table[row, col] = damage
             return True
         return False
 
+    def set_damage_cells(self, hits):
+        """
+        Записывает урон сразу в несколько клеток, у каждой свой.
+
+        :param hits: Итерируемое из (row, col, damage)
+        """
+        hits = list(hits)
+        if hits:
+            rows, cols, damages = zip(*hits)
+            self.damage_table[list(rows), list(cols)] = damages
+
     def reset_damage(self):
         """
         Обнуляет всю таблицу damage_table.
         """
-        for row in range(self.rows):
-            for col in range(self.cols):
-                self.damage_table[row][col] = 0
+        self.damage_table.fill(0)
+
+    def apply_damage(self, mask, damage):
+        """
+        Устанавливает урон сразу во всех клетках маски.
+
+        :param mask: Булев массив формы (rows, cols)
+        :param damage: Значение урона (int)
+        """
+        self.damage_table[mask] = damage
+
+    def occupied_in_mask(self, mask):
+        """
+        Возвращает сущности, стоящие в клетках маски.
+
+        :param mask: Булев массив формы (rows, cols)
+        :return: Список кортежей (entity, row, col) в порядке строк
+        """
+        rows, cols = np.nonzero(mask & (self.occupancy != 0))
+        return [(self._entities_by_id[self.occupancy[row, col]], int(row), int(col)) for row, col in zip(rows, cols)]
+
+    def occupied_in_region(self, row0, col0, row1, col1):
+        """
+        Возвращает сущности в прямоугольнике клеток (границы включительно, обрезаются по полю).
+
+        :return: Список кортежей (entity, row, col)
+        """
+        row0, col0 = max(row0, 0), max(col0, 0)
+        row1, col1 = min(row1, self.rows - 1), min(col1, self.cols - 1)
+        if row0 > row1 or col0 > col1:
+            return []
+        region = self.occupancy[row0:row1 + 1, col0:col1 + 1]
+        rows, cols = np.nonzero(region)
+        return [(self._entities_by_id[region[row, col]], int(row) + row0, int(col) + col0)
+                for row, col in zip(rows, cols)]
+
+    def damage_by_entity(self):
+        """
+        Собирает урон, лежащий под сущностями на поле.
+
+        :return: Словарь {entity: damage} для клеток с ненулевым уроном
+        """
+        hit = (self.damage_table != 0) & (self.occupancy != 0)
+        return {self._entities_by_id[entity_id]: int(damage)
+                for entity_id, damage in zip(self.occupancy[hit], self.damage_table[hit])}
+
+    def stamp(self, stencil, reach, row, col):
+        """
+        Накладывает трафарет с центром в клетке (row, col) на поле.
+
+        :return: Булев массив формы (rows, cols); части трафарета за краем поля отбрасываются
+        """
+        mask = np.zeros((self.rows, self.cols), dtype=bool)
+        top, left = row - reach, col - reach
+        row0, col0 = max(top, 0), max(left, 0)
+        row1 = min(top + stencil.shape[0], self.rows)
+        col1 = min(left + stencil.shape[1], self.cols)
+        if row0 < row1 and col0 < col1:
+            mask[row0:row1, col0:col1] = stencil[row0 - top:row1 - top, col0 - left:col1 - left]
+        return mask
+
+    def circle_mask(self, row, col, radius):
+        """Маска круга радиуса radius клеток с центром в клетке (row, col)."""
+        return self.stamp(*STENCILS.get("circle", radius), row, col)
+
+    def line_mask(self, row, col, length, angle):
+        """Маска линии длиной length клеток из центра клетки (row, col)."""
+        return self.stamp(*STENCILS.get("line", length, angle=angle), row, col)
+
+    def line_cells(self, row, col, length, angle):
+        """
+        Клетки поля, которые пересекает линия из клетки (row, col), по порядку от мага.
+
+        :return: Список (row, col); клетки за краем поля отбрасываются
+        """
+        angle = math.radians(STENCILS.quantize_angle(angle) * STENCILS.angle_step)  # Как у трафарета
+        cells = []
+        for d_row, d_col in supercover_line(length, angle):
+            cell_row, cell_col = row + d_row, col + d_col
+            if 0 <= cell_row < self.rows and 0 <= cell_col < self.cols:
+                cells.append((cell_row, cell_col))
+        return cells
+
+    def cone_mask(self, row, col, height, base, angle):
+        """Маска конуса с вершиной в клетке (row, col)."""
+        return self.stamp(*STENCILS.get("cone", height, base, angle=angle), row, col)
+
+    def rect_mask(self, row0, col0, row1, col1):
+        """Маска прямоугольника клеток (границы включительно)."""
+        mask = np.zeros((self.rows, self.cols), dtype=bool)
+        mask[max(row0, 0):max(row1 + 1, 0), max(col0, 0):max(col1 + 1, 0)] = True
+        return mask
+
+    def cells_mask(self, cells):
+        """
+        Маска из списка клеток.
+
+        :param cells: Итерируемое из кортежей (row, col)
+        """
+        mask = np.zeros((self.rows, self.cols), dtype=bool)
+        cells = list(cells)
+        if cells:
+            rows, cols = zip(*cells)
+            mask[list(rows), list(cols)] = True
+        return mask
+
+    def query_circle(self, row, col, radius):
+        """Сущности в круге: список (entity, row, col)."""
+        return self.occupied_in_mask(self.circle_mask(row, col, radius))
+
+    def query_line(self, row, col, length, angle):
+        """Сущности на линии: список (entity, row, col) в порядке от мага."""
+        hits = []
+        for cell_row, cell_col in self.line_cells(row, col, length, angle):
+            entity = self._entities_by_id[self.occupancy[cell_row, cell_col]]
+            if entity is not None:
+                hits.append((entity, cell_row, cell_col))
+        return hits
+
+    def query_cone(self, row, col, height, base, angle):
+        """Сущности в конусе: список (entity, row, col)."""
+        return self.occupied_in_mask(self.cone_mask(row, col, height, base, angle))
+
+    def query_rect(self, row0, col0, row1, col1):
+        """Сущности в прямоугольнике клеток: список (entity, row, col)."""
+        return self.occupied_in_region(row0, col0, row1, col1)
 
     def get_damage(self, x, y):
         indices = self._get_cell_indices(x, y)
         if indices:
             row, col = indices
-            damage = self.damage_table[row][col]
+            damage = int(self.damage_table[row, col])
             return damage
 
     def report_entities(self):
         print(f'E status check started')
-        for row in range(self.rows):
-            for col in range(self.cols):
-                if self.table[row][col] is not None:
-                    entity = self.table[row][col]
-                    print(f'found En at {row}, {col}, {entity}')
+        for entity, (row, col) in sorted(self.entity_cells.items(), key=lambda item: item[1]):
+            print(f'found En at {row}, {col}, {entity}')
         print(f'E status check ended')
 
     def get_entity_coordinates_by_name(self, entity_name):
@@ -242,15 +686,35 @@ class MapManager:
         :param entity_name: Имя сущности, которую нужно найти
         :return: Кортеж (x, y) — координаты центра клетки или None, если сущность не найдена
         """
-        for row in range(self.rows):
-            for col in range(self.cols):
-                entity = self.table[row][col]
-                if entity and getattr(entity, 'name', '') == entity_name:  # Проверяем имя сущности
-                    # Рассчитываем координаты центра клетки
-                    center_x = self.start_x + col * self.cell_width + self.cell_width / 2
-                    center_y = self.start_y + row * self.cell_height + self.cell_height / 2
-                    return center_x, center_y
-        return None
+        namesakes = self._entities_by_name.get(entity_name)
+        if not namesakes:
+            return None
+        row, col = self.entity_cells[next(iter(namesakes))]
+        # Рассчитываем координаты центра клетки
+        center_x = self.start_x + col * self.cell_width + self.cell_width / 2
+        center_y = self.start_y + row * self.cell_height + self.cell_height / 2
+        return center_x, center_y
+
+
+# Генератор бросков инициативы
+INITIATIVE_RNG = np.random.default_rng()
+
+
+class TimedEffect:
+    """Эффект на сущности, который длится заданное число раундов."""
+
+    def __init__(self, name, entity, expires_round, slot):
+        """
+        :param name: Название эффекта (например, "Bless")
+        :param entity: Сущность, на которой висит эффект
+        :param expires_round: Раунд, в котором эффект закончится
+        :param slot: Место в очереди инициативы, на ходу которого эффект закончится
+        """
+        self.name = name
+        self.entity = entity
+        self.expires_round = expires_round
+        self.slot = slot
+        self.active = True
 
 
 class InitiativeManager:
@@ -262,30 +726,177 @@ class InitiativeManager:
         self.roundtrip = len(ents) - 1
         self.initiatives_set = False
         self.names = [entity.name for entity in self.entities]
+        # Кольцо очерёдности из сущностей, стоящих на поле: entity -> следующий / предыдущий
+        self._next = {}
+        self._prev = {}
+        self.current_entity = None
+        self.board_empty = True
+        self.round = 1
+        # Очередь эффектов: (раунд окончания, слот инициативы, номер, эффект).
+        # Снятые вручную эффекты не удаляются из кучи, а пропускаются при извлечении
+        self._effects = []
+        self._effect_counter = 0
+        self.active_effects = 0
+        self.effects_by_entity = {}  # entity -> {эффект: None} в порядке наложения
+        self._rebuild_turn_ring()
+        self.map_manager.add_listener(self._on_board_change)
+
+    def _rebuild_turn_ring(self):
+        """Заново собирает кольцо очерёдности по текущему порядку entities и состоянию поля."""
+        self._order = {entity: index for index, entity in enumerate(self.entities)}
+        on_board = [entity for entity in self.entities if self.map_manager.get_entity_cell(entity) is not None]
+        self._next = {entity: on_board[(i + 1) % len(on_board)] for i, entity in enumerate(on_board)}
+        self._prev = {entity: on_board[i - 1] for i, entity in enumerate(on_board)}
+        if self.current_entity not in self._order:
+            self.current_entity = on_board[0] if on_board else None
+        self._sync_current_index()
+
+    def _sync_current_index(self):
+        self.board_empty = not self._next
+        if self.current_entity is not None:
+            self.current_index = self._order[self.current_entity]
+
+    def _neighbour(self, step):
+        """
+        Следующее (step=1) или предыдущее (step=-1) существо на поле после текущего.
+        Если текущий ушёл с поля, ищем ближайшего стоящего на поле по порядку инициативы.
+        """
+        ring = self._next if step > 0 else self._prev
+        if self.current_entity in ring:
+            return ring[self.current_entity]
+        index, count = self._order[self.current_entity], len(self.entities)
+        for offset in range(1, count):
+            candidate = self.entities[(index + step * offset) % count]
+            if candidate in self._next:
+                return candidate
+        return None
 
-    def update_current_index(self):
-        # Переход к следующему индексу, игнорируя сущности, которых нет на поле
-        next_index = self.current_index + 1 if self.current_index + 1 <= self.roundtrip else 0
-        current_entity = self.entities[next_index]
+    def _on_board_change(self, entity, on_board):
+        """Обновляет кольцо, когда сущность появляется на поле или уходит с него."""
+        if entity not in self._order:
+            return
+        if on_board and entity not in self._next:
+            # Ищем ближайшего предшественника на поле; это происходит только при входе на поле, не на каждом ходу
+            index = self._order[entity]
+            predecessor = None
+            for offset in range(1, len(self.entities)):
+                candidate = self.entities[index - offset]
+                if candidate in self._next:
+                    predecessor = candidate
+                    break
+            if predecessor is None:
+                self._next[entity] = self._prev[entity] = entity
+            else:
+                successor = self._next[predecessor]
+                self._next[predecessor], self._prev[entity] = entity, predecessor
+                self._next[entity], self._prev[successor] = successor, entity
+            if self.current_entity is None:
+                self.current_entity = entity
+        elif not on_board and entity in self._next:
+            successor, predecessor = self._next.pop(entity), self._prev.pop(entity)
+            if successor is not entity:
+                self._next[predecessor], self._prev[successor] = successor, predecessor
+            # Текущий остаётся текущим, даже уйдя с поля: перемещение токена снимает его с поля
+            # и кладёт обратно, и ход при этом не должен переходить. Пропускаем его только при смене хода
+        self._sync_current_index()
 
-        # Проверяем, находится ли сущность на поле
-        while self.map_manager.get_entity_coordinates_by_name(current_entity.name) is None:
-            next_index = next_index + 1 if next_index + 1 <= self.roundtrip else 0
-            current_entity = self.entities[next_index]
+    def update_current_index(self):
+        """
+        Переход к следующему по инициативе существу на поле.
 
-        self.current_index = next_index  # Обновляем индекс
+        :return: False, если на поле никого нет
+        """
+        if self.board_empty:
+            print('Initiative: no entities on the board')
+            return False
+        previous_index = self.current_index
+        self.current_entity = self._neighbour(1)
+        self._sync_current_index()
+        if self.current_index <= previous_index:
+            self.round += 1  # Очередь пошла по новому кругу
+        self._expire_effects()
+        return True
 
     def gowngrade_current_index(self):
-        # Переход к предыдущему индексу, игнорируя сущности, которых нет на поле
-        prev_index = self.current_index - 1 if self.current_index - 1 >= 0 else self.roundtrip
-        current_entity = self.entities[prev_index]
+        """
+        Переход к предыдущему по инициативе существу на поле.
 
-        # Проверяем, находится ли сущность на поле
-        while self.map_manager.get_entity_coordinates_by_name(current_entity.name) is None:
-            prev_index = prev_index - 1 if prev_index - 1 >= 0 else self.roundtrip
-            current_entity = self.entities[prev_index]
+        :return: False, если на поле никого нет
+        """
+        if self.board_empty:
+            print('Initiative: no entities on the board')
+            return False
+        previous_index = self.current_index
+        self.current_entity = self._neighbour(-1)
+        self._sync_current_index()
+        if self.current_index >= previous_index and self.round > 1:
+            self.round -= 1
+        return True
+
+    def add_effect(self, entity, name, rounds):
+        """
+        Накладывает эффект на сущность на заданное число раундов.
+        Эффект заканчивается в начале того же хода инициативы через rounds раундов.
+
+        :return: Созданный TimedEffect
+        """
+        effect = TimedEffect(name, entity, self.round + max(1, int(rounds)), self.current_index)
+        self._effect_counter += 1
+        heapq.heappush(self._effects, (effect.expires_round, effect.slot, self._effect_counter, effect))
+        self.effects_by_entity.setdefault(entity, {})[effect] = None
+        self.active_effects += 1
+        return effect
+
+    def remove_effect(self, effect):
+        """Снимает эффект досрочно (например, при потере концентрации)."""
+        if not effect.active:
+            return
+        effect.active = False
+        self.active_effects -= 1
+        effects = self.effects_by_entity.get(effect.entity)
+        if effects is not None:
+            effects.pop(effect, None)
+            if not effects:
+                del self.effects_by_entity[effect.entity]
+        # Запись в куче станет мусором; чистим кучу, когда мусора больше половины
+        if len(self._effects) > 2 * self.active_effects + 16:
+            self._effects = [item for item in self._effects if item[3].active]
+            heapq.heapify(self._effects)
+
+    def effects_on(self, entity):
+        """Список активных эффектов на сущности."""
+        return list(self.effects_by_entity.get(entity, ()))
+
+    def remaining_rounds(self, effect):
+        """Сколько раундов ещё продлится эффект (на ходу окончания — 0)."""
+        remaining = effect.expires_round - self.round
+        if self.current_index < effect.slot:
+            remaining += 1  # Ход, на котором эффект закончится, в этом раунде ещё не наступил
+        return max(0, remaining)
+
+    def _reschedule_effects(self, pending):
+        """
+        Пересчитывает раунд и слот окончания эффектов после смены порядка инициативы.
 
-        self.current_index = prev_index  # Обновляем индекс
+        :param pending: Список (эффект, оставшиеся раунды, сущность, на чьём ходу эффект кончается)
+        """
+        self._effects = []
+        for effect, remaining, owner in pending:
+            effect.slot = self._order[owner]
+            # Обратное к remaining_rounds: если ход владельца в этом раунде ещё впереди, раунд уже идёт в счёт
+            effect.expires_round = self.round + remaining - (1 if self.current_index < effect.slot else 0)
+            self._effect_counter += 1
+            self._effects.append((effect.expires_round, effect.slot, self._effect_counter, effect))
+        heapq.heapify(self._effects)
+
+    def _expire_effects(self):
+        """Снимает все эффекты, чей (раунд, слот) уже наступил."""
+        now = (self.round, self.current_index)
+        while self._effects and self._effects[0][:2] <= now:
+            effect = heapq.heappop(self._effects)[3]
+            if effect.active:
+                self.remove_effect(effect)
+                print(f"Effect expired: {effect.name} on {effect.entity.name}")
     
     @staticmethod
     def input_boxes_tk(names):
@@ -298,17 +909,17 @@ class InitiativeManager:
         root.geometry("300x" + str(50 * len(names)))
         root.attributes("-topmost", True)
     
-        entries = {}
+        entries = []
     
         for i, name in enumerate(names):
             label = tk.Label(root, text=name)
             label.grid(row=i, column=0, padx=5, pady=5, sticky="w")
             entry = tk.Entry(root)
             entry.grid(row=i, column=1, padx=5, pady=5, sticky="e")
-            entries[name] = entry
+            entries.append(entry)
     
         def submit():
-            root.result = [entry.get() if entry.get() else None for entry in entries.values()]
+            root.result = [entry.get() if entry.get() else None for entry in entries]
             root.destroy()
     
         submit_button = tk.Button(root, text="OK", command=submit)
@@ -319,47 +930,65 @@ class InitiativeManager:
         return root.result
     
     def set_initiatives(self):
-        namelist = [entity.name for entity in self.entities]
-        numbers = []
-        for number in self.input_boxes_tk(namelist):
+        """
+        Бросает инициативу. Игроки вводят свои броски в окне Tk, монстры
+        и игроки с пустым полем получают d20 + модификатор одним броском на всех.
+        """
+        players = [entity for entity in self.entities if entity.entity_type == 'Player']
+        typed = self.input_boxes_tk([f"{entity.name} ({entity.initiative_modifier:+d})" for entity in players]) \
+            if players else []
+        typed_by_entity = dict(zip(players, typed or []))
+
+        modifiers = np.array([entity.initiative_modifier for entity in self.entities], dtype=np.int64)
+        rolls = INITIATIVE_RNG.integers(1, 21, size=len(self.entities)) + modifiers
+        for entity, rolled in zip(self.entities, rolls.tolist()):
             try:
-                numbers.append(int(number))
+                entity.initiative = int(typed_by_entity.get(entity))
             except (ValueError, TypeError):
-                numbers.append(0)
-
-        for entity, number in zip(self.entities, numbers):
-            entity.initiative = number
-    
-        # Сортируем entities по инициативе
-        self.entities.sort(key=lambda entity: entity.initiative, reverse=True)
+                entity.initiative = rolled
+
+        # Слот эффекта — место в старой очереди; запоминаем, сколько раундов осталось и на чьём ходу он кончается
+        pending = [(effect, self.remaining_rounds(effect), self.entities[effect.slot])
+                   for *_, effect in self._effects if effect.active]
+        self.entities[:] = self.order_by_initiative(self.entities)
+        self.current_entity = None  # Бой начинается с самого быстрого на поле
+        self._rebuild_turn_ring()
+        self.round = 1
+        self._reschedule_effects(pending)
         self.initiatives_set = True
 
-    def draw_current_entity_rect(self, screen):
-        if not self.initiatives_set:
-            return  # Если инициатива не установлена, ничего не рисуем
+    @staticmethod
+    def order_by_initiative(entities):
+        """
+        Сортирует сущности по убыванию инициативы. Ничьи решаются детерминированно:
+        больший модификатор, затем игрок раньше монстра, затем исходный порядок.
+        """
+        if not entities:
+            return []
+        initiatives = np.array([entity.initiative for entity in entities], dtype=np.int64)
+        modifiers = np.array([entity.initiative_modifier for entity in entities], dtype=np.int64)
+        is_monster = np.array([entity.entity_type != 'Player' for entity in entities])
+        # lexsort сортирует по последнему ключу в первую очередь
+        order = np.lexsort((np.arange(len(entities)), is_monster, -modifiers, -initiatives))
+        return [entities[i] for i in order]
+
+    def get_current_entity_rect(self):
+        """
+        Возвращает клетку текущего по инициативе существа.
 
-        current_entity = self.entities[self.current_index]
+        :return: pygame.Rect клетки или None, если инициатива не задана или существа нет на поле
+        """
+        if not self.initiatives_set or self.current_entity is None:
+            return None
+        cell = self.map_manager.get_entity_cell(self.current_entity)
+        if cell is None:
+            return None
+        return self.map_manager.cell_rect(*cell)
 
-        # Получаем координаты центра клетки для текущей сущности
-        try:
-            center_x, center_y = self.map_manager.get_entity_coordinates_by_name(current_entity.name)
-        except TypeError:
-            self.update_current_index()
-            return
-        if center_x is None or center_y is None:
-            return  # Если не найдено, ничего не рисуем
-
-        # Создаем pygame.Rect с заданными параметрами
-        rect = pygame.Rect(center_x - self.map_manager.cell_width / 2, 
-                           center_y - self.map_manager.cell_height / 2, 
-                           self.map_manager.cell_width, 
-                           self.map_manager.cell_height)
+    def draw_current_entity_rect(self, screen):
+        rect = self.get_current_entity_rect()
+        if rect is None:
+            return  # Если инициатива не установлена или никого нет на поле, ничего не рисуем
         
         # Рисуем прямоугольник с прозрачным зеленым фоном
         pygame.draw.rect(screen, Gameclass.CURRENT_COLOR_PRESET.initiative, rect, 2)  # Обводка прямоугольника (зеленая)
-
-        
-        
-
-        
-        
@@ -0,0 +1,138 @@
+import pygame
+import Gameclass
+import render_tools
+
+
+class TextPrompt:
+    """Запрос строки у мастера; ответ передаётся в callback."""
+
+    def __init__(self, prompt, callback, numeric=True, on_cancel=None):
+        """
+        :param prompt: Текст запроса
+        :param callback: Вызывается с введённой строкой после Enter
+        :param numeric: True — принимаются только цифры
+        :param on_cancel: Вызывается при отмене через Esc
+        """
+        self.prompt = prompt
+        self.callback = callback
+        self.numeric = numeric
+        self.on_cancel = on_cancel
+        self.text = ""
+
+    def accepts(self, char):
+        if not char or not char.isprintable():
+            return False
+        if self.numeric:
+            return char.isdigit()
+        return True
+
+
+class PromptManager:
+    """
+    Поля ввода и всплывающие сообщения, которые рисуются прямо в окне pygame.
+
+    Запросы стоят в очереди и не блокируют главный цикл: пока запрос открыт, ему
+    достаются все нажатия клавиш, а ответ уходит в callback. Сообщения (тосты)
+    исчезают сами через duration миллисекунд.
+    """
+
+    TOAST_DURATION = 1500
+    BOX_WIDTH = 420
+    BOX_HEIGHT = 90
+
+    def __init__(self):
+        self._prompts = []
+        self._toasts = []  # (текст, момент исчезновения в мс)
+
+    @property
+    def active(self):
+        """Текущий запрос или None."""
+        return self._prompts[0] if self._prompts else None
+
+    def ask(self, prompt, callback, numeric=True, on_cancel=None):
+        """Ставит запрос в очередь и сразу возвращает управление."""
+        text_prompt = TextPrompt(prompt, callback, numeric, on_cancel)
+        self._prompts.append(text_prompt)
+        return text_prompt
+
+    def toast(self, message, duration=TOAST_DURATION):
+        """Показывает сообщение, которое исчезнет через duration мс."""
+        self._toasts.append((message, pygame.time.get_ticks() + duration))
+
+    def has_toasts(self):
+        return bool(self._toasts)
+
+    def update(self):
+        """Убирает истёкшие сообщения."""
+        now = pygame.time.get_ticks()
+        self._toasts = [toast for toast in self._toasts if toast[1] > now]
+
+    def handle_event(self, event):
+        """
+        Обрабатывает ввод в открытом запросе.
+
+        :return: True, если событие поглощено и дальше передаваться не должно
+        """
+        prompt = self.active
+        if prompt is None or event.type != pygame.KEYDOWN:
+            return False
+        if event.key in (pygame.K_RETURN, pygame.K_KP_ENTER):
+            self._prompts.pop(0)
+            prompt.callback(prompt.text)
+        elif event.key == pygame.K_ESCAPE:
+            self._prompts.pop(0)
+            if prompt.on_cancel:
+                prompt.on_cancel()
+        elif event.key == pygame.K_BACKSPACE:
+            prompt.text = prompt.text[:-1]
+        elif prompt.accepts(event.unicode):
+            prompt.text += event.unicode
+        return True
+
+    def _box_rect(self, surface):
+        rect = pygame.Rect(0, 0, self.BOX_WIDTH, self.BOX_HEIGHT)
+        rect.center = surface.get_rect().center
+        return rect
+
+    def _toast_rects(self, surface):
+        rects = []
+        y = 20
+        for message, _ in self._toasts:
+            rect = render_tools.render_text(message, 32, (255, 255, 255)).get_rect(midtop=(surface.get_width() // 2, y))
+            rects.append(rect.inflate(20, 10))
+            y += rect.height + 16
+        return rects
+
+    def get_bounds(self, surface):
+        """Область экрана, занятая запросом и сообщениями (или None)."""
+        rects = self._toast_rects(surface)
+        if self.active is not None:
+            rects.append(self._box_rect(surface))
+        return rects[0].unionall(rects[1:]) if rects else None
+
+    def get_render_state(self):
+        prompt = self.active
+        return (prompt.prompt if prompt else None, prompt.text if prompt else None,
+                tuple(message for message, _ in self._toasts))
+
+    def draw(self, surface):
+        preset = Gameclass.CURRENT_COLOR_PRESET
+        for (message, _), rect in zip(self._toasts, self._toast_rects(surface)):
+            pygame.draw.rect(surface, preset.button_fill, rect, border_radius=8)
+            label = render_tools.render_text(message, 32, preset.button_font[:3])
+            surface.blit(label, label.get_rect(center=rect.center))
+
+        prompt = self.active
+        if prompt is None:
+            return
+        box = self._box_rect(surface)
+        pygame.draw.rect(surface, preset.button_fill, box, border_radius=8)
+        pygame.draw.rect(surface, preset.button_border, box, 2, border_radius=8)
+        title = render_tools.render_text(prompt.prompt, 24, preset.button_font[:3])
+        surface.blit(title, (box.x + 12, box.y + 10))
+        entry = render_tools.render_text(prompt.text + "_", 40, preset.button_font[:3])
+        surface.blit(entry, (box.x + 12, box.y + 40))
+
+
+# Общий менеджер запросов; главный цикл передаёт ему события и рисует его поверх сцены
+PROMPTS = PromptManager()
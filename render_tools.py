@@ -0,0 +1,334 @@
+import math
+import os
+from collections import OrderedDict
+import pygame
+
+
+class DirtyRectRenderer:
+    """
+    Отслеживает изменившиеся области экрана и обновляет только их.
+
+    Каждый кадр объекты регистрируются через track(): если прямоугольник
+    или состояние объекта изменились с прошлого кадра, старая и новая
+    области помечаются «грязными». Объект, который перестал регистрироваться,
+    тоже инвалидирует свою последнюю область.
+    """
+
+    def __init__(self, screen, full_redraw=False):
+        """
+        :param screen: Поверхность окна (pygame.display)
+        :param full_redraw: True — всегда перерисовывать весь экран и вызывать flip()
+        """
+        self.screen = screen
+        self.full_redraw = full_redraw
+        self._tracked = {}  # key -> (rect, state) с прошлого кадра
+        self._seen = {}  # key -> (rect, state) текущего кадра
+        self._dirty = []
+        self._full = True  # Первый кадр всегда рисуется целиком
+        self._frame_rects = []
+
+    def invalidate(self, rect):
+        """Помечает область как требующую перерисовки."""
+        if rect is None:
+            return
+        rect = pygame.Rect(rect)
+        if rect.width > 0 and rect.height > 0:
+            self._dirty.append(rect)
+
+    def invalidate_all(self):
+        """Помечает весь экран как требующий перерисовки."""
+        self._full = True
+
+    def track(self, key, rect, state=None):
+        """
+        Регистрирует объект, занимающий на экране область rect.
+
+        :param key: Уникальный ключ объекта
+        :param rect: pygame.Rect, который объект занимает в этом кадре (или None)
+        :param state: Любое сравнимое значение; его изменение инвалидирует область
+        """
+        rect = pygame.Rect(rect) if rect is not None else None
+        self._seen[key] = (rect, state)
+        previous = self._tracked.get(key)
+        if previous is None:
+            self.invalidate(rect)
+            return
+        old_rect, old_state = previous
+        if old_rect != rect or old_state != state:
+            self.invalidate(old_rect)
+            self.invalidate(rect)
+
+    def begin_frame(self):
+        """
+        Завершает регистрацию объектов и готовит экран к отрисовке.
+
+        :return: True, если в этом кадре есть что рисовать
+        """
+        for key, (old_rect, _) in self._tracked.items():
+            if key not in self._seen:
+                self.invalidate(old_rect)
+        self._tracked, self._seen = self._seen, {}
+
+        screen_rect = self.screen.get_rect()
+        if self.full_redraw or self._full:
+            self._frame_rects = [screen_rect]
+        else:
+            self._frame_rects = [rect.clip(screen_rect) for rect in self._dirty]
+            self._frame_rects = [rect for rect in self._frame_rects if rect.width and rect.height]
+        self._dirty = []
+        self._full = False
+
+        if not self._frame_rects:
+            return False
+        # Всё, что рисуется дальше, ограничено объединением грязных областей
+        self.screen.set_clip(self._frame_rects[0].unionall(self._frame_rects[1:]))
+        return True
+
+    def end_frame(self):
+        """Выводит нарисованный кадр на дисплей."""
+        self.screen.set_clip(None)
+        if self.full_redraw or self._frame_rects == [self.screen.get_rect()]:
+            pygame.display.flip()
+        else:
+            pygame.display.update(self._frame_rects)
+        self._frame_rects = []
+
+
+class FrameScheduler:
+    """
+    Управляет темпом главного цикла.
+
+    Пока что-то анимируется или перетаскивается, цикл ограничен active_fps.
+    Когда поле простаивает, цикл спит в pygame.event.wait до прихода события
+    (или до idle_timeout миллисекунд), не нагружая процессор.
+    """
+
+    def __init__(self, active_fps=60, idle_timeout=500):
+        """
+        :param active_fps: Максимальная частота кадров в активном режиме
+        :param idle_timeout: Максимальное время сна в простое, мс
+        """
+        self.clock = pygame.time.Clock()
+        self.active_fps = active_fps
+        self.idle_timeout = idle_timeout
+        self.frames_rendered = 0
+        self.frames_skipped = 0
+
+    def wait_events(self, busy):
+        """
+        Ждёт следующий кадр и возвращает накопившиеся события.
+
+        :param busy: True, если на экране идёт анимация или перетаскивание
+        :return: Список событий pygame (может быть пустым)
+        """
+        # Ограничение частоты действует и в простое: поток MOUSEMOTION не разгонит цикл
+        self.clock.tick(self.active_fps)
+        if busy:
+            return pygame.event.get()
+
+        event = pygame.event.wait(self.idle_timeout)
+        events = [] if event.type == pygame.NOEVENT else [event]
+        events.extend(pygame.event.get())
+        return events
+
+    def frame_rendered(self):
+        self.frames_rendered += 1
+
+    def frame_skipped(self):
+        self.frames_skipped += 1
+
+    def report(self):
+        """Возвращает строку со статистикой отрисованных и пропущенных кадров."""
+        total = self.frames_rendered + self.frames_skipped
+        skipped_share = self.frames_skipped / total * 100 if total else 0
+        return (f"Frames rendered: {self.frames_rendered}, skipped: {self.frames_skipped} "
+                f"({skipped_share:.1f}% skipped)")
+
+
+class SpriteCache:
+    """
+    Ограниченный LRU-кэш подготовленных поверхностей.
+
+    Ограничивается и числом поверхностей, и их суммарным объёмом в байтах:
+    повёрнутые спрайты крупных клеток весят по нескольку мегабайт.
+    Считает попадания и промахи, чтобы по статистике подбирать лимиты.
+    """
+
+    def __init__(self, max_size=256, max_bytes=None):
+        """
+        :param max_size: Максимальное число поверхностей
+        :param max_bytes: Максимальный суммарный объём пикселей в байтах (None — без ограничения)
+        """
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()  # ключ -> (поверхность, байты)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def surface_bytes(surface):
+        """Объём пикселей поверхности: ширина × высота × байт на пиксель."""
+        width, height = surface.get_size()
+        return width * height * surface.get_bytesize()
+
+    def get(self, key, factory):
+        """
+        Возвращает поверхность по ключу; при промахе создаёт её вызовом factory().
+        """
+        item = self._items.get(key)
+        if item is not None:
+            self._items.move_to_end(key)
+            self.hits += 1
+            return item[0]
+        self.misses += 1
+        surface = factory()
+        size = self.surface_bytes(surface)
+        self._items[key] = (surface, size)
+        self.bytes += size
+        # Вытесняем самые давние; только что созданная поверхность остаётся, даже если одна больше бюджета
+        while len(self._items) > 1 and (len(self._items) > self.max_size
+                                        or (self.max_bytes is not None and self.bytes > self.max_bytes)):
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+        return surface
+
+    def clear(self):
+        self._items.clear()
+        self.bytes = 0
+
+    def __len__(self):
+        return len(self._items)
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        """Словарь со статистикой кэша."""
+        return {"size": len(self._items), "max_size": self.max_size,
+                "bytes": self.bytes, "max_bytes": self.max_bytes, "evictions": self.evictions,
+                "hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate}
+
+
+# Шрифты по размеру: pygame.font.Font(None, size) дорог, создаём каждый размер один раз
+_FONTS = {}
+# Отрисованные надписи по ключу (текст, размер, цвет)
+TEXT_CACHE = SpriteCache(max_size=512)
+
+
+def get_font(size):
+    """Возвращает общий шрифт по умолчанию заданного размера."""
+    size = int(size)
+    font = _FONTS.get(size)
+    if font is None:
+        font = pygame.font.Font(None, size)
+        _FONTS[size] = font
+    return font
+
+
+def render_text(text, size, color):
+    """Возвращает поверхность с надписью, отрисовывая её только при первом запросе."""
+    text, size, color = str(text), int(size), tuple(color)
+    return TEXT_CACHE.get((text, size, color), lambda: get_font(size).render(text, True, color))
+
+
+# Папка с иконками рядом с модулями программы
+ICONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "icons")
+
+
+class IconAtlas:
+    """
+    Все PNG из папки icons в одной поверхности-атласе.
+
+    Атлас загружается один раз; для каждого размера иконок строится одна
+    масштабированная копия, а иконки выдаются как её подповерхности.
+    """
+
+    # Максимальная ширина полки при упаковке исходного атласа
+    MAX_ROW_WIDTH = 2048
+
+    def __init__(self, icons_dir=ICONS_DIR):
+        self.icons_dir = icons_dir
+        self.surface = None
+        self._rects = {}  # имя файла -> Rect в исходном атласе
+        self._scaled = {}  # размер -> (поверхность, {имя -> Rect})
+        self._extra = {}  # (путь, размер) -> иконка не из атласа
+        self._pack()
+
+    def _pack(self):
+        names = sorted(name for name in os.listdir(self.icons_dir) if name.lower().endswith(".png")) \
+            if os.path.isdir(self.icons_dir) else []
+        images = [(name, pygame.image.load(os.path.join(self.icons_dir, name))) for name in names]
+        if not images:
+            return
+
+        # Простая упаковка по полкам: иконки кладутся в ряд, пока помещаются по ширине
+        x = y = shelf_height = atlas_width = 0
+        for name, image in images:
+            width, height = image.get_size()
+            if x and x + width > self.MAX_ROW_WIDTH:
+                x, y = 0, y + shelf_height
+                shelf_height = 0
+            self._rects[name] = pygame.Rect(x, y, width, height)
+            x += width
+            atlas_width = max(atlas_width, x)
+            shelf_height = max(shelf_height, height)
+
+        self.surface = pygame.Surface((atlas_width, y + shelf_height), pygame.SRCALPHA)
+        for name, image in images:
+            self.surface.blit(image, self._rects[name])
+        if pygame.display.get_surface() is not None:
+            self.surface = self.surface.convert_alpha()
+
+    def _get_scaled(self, size):
+        """Атлас, в котором каждая иконка уже уменьшена до size x size."""
+        scaled = self._scaled.get(size)
+        if scaled is None:
+            names = sorted(self._rects)
+            columns = max(1, math.ceil(math.sqrt(len(names))))
+            rows = math.ceil(len(names) / columns)
+            surface = pygame.Surface((columns * size, rows * size), pygame.SRCALPHA)
+            rects = {}
+            for index, name in enumerate(names):
+                rect = pygame.Rect((index % columns) * size, (index // columns) * size, size, size)
+                icon = pygame.transform.smoothscale(self.surface.subsurface(self._rects[name]), (size, size))
+                surface.blit(icon, rect)
+                rects[name] = rect
+            scaled = (surface, rects)
+            self._scaled[size] = scaled
+        return scaled
+
+    def get(self, icon_path, size):
+        """
+        Возвращает иконку размером size x size.
+
+        :param icon_path: Имя файла иконки (путь допускается, берётся имя файла)
+        :param size: Сторона иконки в пикселях
+        """
+        name = os.path.basename(icon_path)
+        if name in self._rects:
+            surface, rects = self._get_scaled(size)
+            return surface.subsurface(rects[name])
+
+        # Иконки нет в атласе — грузим по пути, как раньше, но тоже один раз
+        key = (icon_path, size)
+        icon = self._extra.get(key)
+        if icon is None:
+            icon = pygame.transform.smoothscale(pygame.image.load(icon_path), (size, size))
+            self._extra[key] = icon
+        return icon
+
+
+_ICON_ATLAS = None
+
+
+def get_icon_atlas():
+    """Общий атлас иконок, загружаемый при первом обращении."""
+    global _ICON_ATLAS
+    if _ICON_ATLAS is None:
+        _ICON_ATLAS = IconAtlas()
+    return _ICON_ATLAS
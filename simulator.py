@@ -0,0 +1,222 @@
+"""
+Симулятор боёв без графики: много раз разыгрывает бой из файла битвы
+и показывает, насколько встреча опасна для игроков.
+
+Пример:
+    python simulator.py test_game.json --fights 5000 --workers 4
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from Gameclass import Game
+import EntityManager
+import dice
+
+# Атака по умолчанию для сущностей без attack_bonus/damage в JSON
+DEFAULT_ATTACK_BONUS = 2
+DEFAULT_DAMAGE = "1d6"
+
+PLAYERS_WIN, MONSTERS_WIN, TIMEOUT = 0, 1, 2
+
+
+def _target_random(hp, enemies, rng):
+    return enemies[rng.integers(len(enemies))]
+
+
+def _target_weakest(hp, enemies, rng):
+    # Добиваем самого раненого; при равенстве — первого по списку
+    return min(enemies, key=lambda i: hp[i])
+
+
+def _target_strongest(hp, enemies, rng):
+    return max(enemies, key=lambda i: hp[i])
+
+
+# Простые политики выбора цели: (текущие HP, индексы живых врагов, генератор) -> индекс цели
+POLICIES = {
+    "random": _target_random,
+    "weakest": _target_weakest,
+    "strongest": _target_strongest,
+}
+
+
+def resolve_path(path, base_dir):
+    """Путь из файла битвы: сначала относительно самого файла, затем относительно текущей папки."""
+    if os.path.isabs(path):
+        return path
+    candidate = os.path.join(base_dir, path)
+    return candidate if os.path.exists(candidate) else path
+
+
+def load_combatants(battle_path):
+    """
+    Загружает участников боя из файла битвы.
+
+    :return: (Game, список словарей с характеристиками участников)
+    """
+    game = Game(battle_path)
+    base_dir = os.path.dirname(os.path.abspath(battle_path))
+    players = EntityManager.load_from_json(resolve_path(game.players_path, base_dir))
+    monsters = EntityManager.load_from_json(resolve_path(game.monsters_path, base_dir))
+
+    combatants = []
+    for entity in players + monsters:
+        if not dice.has_attack_stats(entity):
+            print(f"{entity.name}: no attack_bonus/damage, using +{DEFAULT_ATTACK_BONUS} {DEFAULT_DAMAGE}")
+        combatants.append({
+            "name": entity.name,
+            "side": PLAYERS_WIN if entity.entity_type == 'Player' else MONSTERS_WIN,
+            "hp": int(entity.hp),
+            "armor_class": int(entity.armor_class),
+            "initiative_modifier": int(entity.initiative_modifier),
+            "attack_bonus": int(entity.attack_bonus) if dice.has_attack_stats(entity) else DEFAULT_ATTACK_BONUS,
+            "damage": str(entity.damage) if dice.has_attack_stats(entity) else DEFAULT_DAMAGE,
+        })
+    return game, combatants
+
+
+def run_fights(combatants, fights, seed, max_rounds=50, player_policy="weakest", monster_policy="weakest"):
+    """
+    Разыгрывает серию боёв в текущем процессе.
+
+    Все d20 и броски урона на серию бросаются заранее, по одному вызову NumPy на участника;
+    сам бой — лёгкий цикл по очереди инициативы. Позиции на карте не учитываются:
+    каждый ход участник атакует выбранного политикой живого врага.
+
+    :param combatants: Список словарей из load_combatants
+    :param fights: Количество боёв
+    :param seed: Зерно (int или np.random.SeedSequence)
+    :param max_rounds: Бой без победителя после стольких раундов считается ничьей
+    :return: (исходы, число раундов, остаток HP формы (fights, участники), затраченное время в секундах)
+    """
+    started = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    count = len(combatants)
+    sides = np.array([combatant["side"] for combatant in combatants])
+    max_hp = np.array([combatant["hp"] for combatant in combatants], dtype=np.int64)
+    armor = [combatant["armor_class"] for combatant in combatants]
+    bonus = [combatant["attack_bonus"] for combatant in combatants]
+    modifiers = np.array([combatant["initiative_modifier"] for combatant in combatants], dtype=np.int64)
+    is_monster = sides == MONSTERS_WIN
+    policies = [POLICIES[monster_policy if side == MONSTERS_WIN else player_policy] for side in sides]
+    side_of = sides.tolist()
+
+    # Заранее брошенные d20 и урон: [участник] -> массив (fights, max_rounds)
+    naturals = dice.roll_d20((count, fights, max_rounds), rng=rng)
+    damages = []
+    for index, combatant in enumerate(combatants):
+        crit = naturals[index] >= 20
+        rolls = dice.parse_cached(combatant["damage"]).roll(fights * max_rounds, crit=crit.ravel(), rng=rng)
+        damages.append(np.maximum(rolls, 0).reshape(fights, max_rounds).tolist())
+    naturals = naturals.tolist()
+    initiative = rng.integers(1, 21, size=(fights, count)) + modifiers
+
+    outcomes = np.full(fights, TIMEOUT, dtype=np.int8)
+    rounds_taken = np.full(fights, max_rounds, dtype=np.int32)
+    hp_left = np.empty((fights, count), dtype=np.int64)
+    indices = np.arange(count)
+    for fight in range(fights):
+        # Та же детерминированная развязка ничьих, что и в InitiativeManager.order_by_initiative
+        order = np.lexsort((indices, is_monster, -modifiers, -initiative[fight])).tolist()
+        hp = max_hp.tolist()
+        alive = [[i for i in range(count) if side_of[i] == side] for side in (PLAYERS_WIN, MONSTERS_WIN)]
+        finished = False
+        for round_index in range(max_rounds):
+            for attacker in order:
+                if hp[attacker] <= 0:
+                    continue
+                enemies = alive[1 - side_of[attacker]]
+                target = policies[attacker](hp, enemies, rng)
+                natural = naturals[attacker][fight][round_index]
+                if natural == 20 or (natural != 1 and natural + bonus[attacker] >= armor[target]):
+                    hp[target] -= damages[attacker][fight][round_index]
+                    if hp[target] <= 0:
+                        enemies.remove(target)
+                        if not enemies:
+                            outcomes[fight] = side_of[attacker]
+                            rounds_taken[fight] = round_index + 1
+                            finished = True
+                            break
+            if finished:
+                break
+        hp_left[fight] = np.maximum(hp, 0)
+    return outcomes, rounds_taken, hp_left, time.perf_counter() - started
+
+
+def simulate(combatants, fights=2000, workers=None, seed=None, max_rounds=50,
+             player_policy="weakest", monster_policy="weakest", chunk_size=500):
+    """
+    Разыгрывает fights боёв в пуле процессов.
+
+    :return: (исходы, число раундов, остаток HP, суммарное время работы процессов, время по часам)
+    :raises ValueError: Если fights меньше 1
+    """
+    if fights < 1:
+        raise ValueError(f"fights must be at least 1, got {fights}")
+    workers = workers or os.cpu_count() or 1
+    sizes = [chunk_size] * (fights // chunk_size) + ([fights % chunk_size] if fights % chunk_size else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_fights, combatants, size, chunk_seed, max_rounds, player_policy, monster_policy)
+                   for size, chunk_seed in zip(sizes, seeds)]
+        results = [future.result() for future in futures]
+    wall_time = time.perf_counter() - started
+
+    outcomes = np.concatenate([result[0] for result in results])
+    rounds_taken = np.concatenate([result[1] for result in results])
+    hp_left = np.concatenate([result[2] for result in results])
+    busy_time = sum(result[3] for result in results)
+    return outcomes, rounds_taken, hp_left, busy_time, wall_time
+
+
+def report(combatants, outcomes, rounds_taken, hp_left, busy_time, wall_time, workers):
+    """Возвращает текстовый отчёт по результатам симуляции."""
+    fights = len(outcomes)
+    lines = [f"Fights: {fights}"]
+    for label, outcome in (("Players win", PLAYERS_WIN), ("Monsters win", MONSTERS_WIN), ("Timeout", TIMEOUT)):
+        lines.append(f"{label}: {np.mean(outcomes == outcome):.1%}")
+
+    resolved = rounds_taken[outcomes != TIMEOUT]
+    if len(resolved):
+        p10, p50, p90 = np.percentile(resolved, [10, 50, 90])
+        lines.append(f"Rounds to resolution: mean {resolved.mean():.1f}, p10 {p10:.0f}, median {p50:.0f}, p90 {p90:.0f}")
+
+    lines.append("HP remaining (p10 / median / p90, share dead):")
+    for index, combatant in enumerate(combatants):
+        p10, p50, p90 = np.percentile(hp_left[:, index], [10, 50, 90])
+        dead = np.mean(hp_left[:, index] == 0)
+        lines.append(f"  {combatant['name']:<16} {p10:5.0f} / {p50:5.0f} / {p90:5.0f} of {combatant['hp']:<4} "
+                     f"dead {dead:.1%}")
+
+    lines.append(f"Wall time: {wall_time:.2f} s on {workers} workers, {fights / wall_time:.0f} fights/s")
+    lines.append(f"Throughput: {fights / busy_time:.0f} fights/s per core")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Monte Carlo encounter simulator")
+    parser.add_argument("battle", help="JSON-файл битвы, например test_game.json")
+    parser.add_argument("--fights", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=None, help="По умолчанию — число ядер")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--max-rounds", type=int, default=50)
+    parser.add_argument("--player-policy", choices=sorted(POLICIES), default="weakest")
+    parser.add_argument("--monster-policy", choices=sorted(POLICIES), default="weakest")
+    args = parser.parse_args()
+    if args.fights < 1:
+        parser.error("--fights must be at least 1")
+
+    game, combatants = load_combatants(args.battle)
+    workers = args.workers or os.cpu_count() or 1
+    print(f"Simulating '{game.title}': {len(combatants)} combatants")
+    results = simulate(combatants, args.fights, workers, args.seed, args.max_rounds,
+                       args.player_policy, args.monster_policy)
+    print(report(combatants, *results, workers))
+
+
+if __name__ == "__main__":
+    main()